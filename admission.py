@@ -0,0 +1,156 @@
+"""
+Модуль контроля нагрузки (admission control)
+Лимит запросов на пользователя, общий лимит параллельной обработки
+и справедливая очередь между пользователями
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set
+from loguru import logger
+
+# Причины отказа в обработке
+SHED_RATE_LIMIT = 'rate_limit'  # пользователь превысил свой лимит
+SHED_SILENT = 'silent'          # превысил снова - уже предупреждали, молчим
+SHED_OVERLOAD = 'overload'      # общая очередь переполнена
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше burst про запас
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.warned = False
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class AdmissionController:
+    """
+    Ставит задачи пользователей в очередь и выполняет их пулом потоков.
+    Очереди (по умолчанию - пользователя, или по ключу queue_key, например чата)
+    обслуживаются по кругу по одной задаче за раз, задачи одной очереди - строго по порядку
+    """
+
+    def __init__(self, user_rate: float, user_burst: float, max_concurrency: int, max_queue: int):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_queue = max_queue
+
+        self._cond = threading.Condition()
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[Callable[[], None]]] = {}
+        self._ready: Deque[int] = deque()  # пользователи с задачами, ждущие своей очереди
+        self._active: Set[int] = set()     # пользователи, чья задача выполняется сейчас
+        self._depth = 0
+
+        # Метрики
+        self._admitted = 0
+        self._shed_rate_limit = 0
+        self._shed_overload = 0
+        self._peak_depth = 0
+
+        for i in range(max_concurrency):
+            threading.Thread(target=self._worker, name=f"admission-{i}", daemon=True).start()
+
+    def submit(self, user_id: int, job: Callable[[], None], queue_key: Optional[int] = None) -> Optional[str]:
+        """
+        Пытается поставить задачу пользователя в очередь
+
+        Args:
+            queue_key: Очередь, в которой задача ждет и выполняется по порядку
+                (по умолчанию - очередь пользователя). Лимит все равно на пользователя
+
+        Returns:
+            str: Причина отказа (SHED_*) или None если задача принята
+        """
+        now = time.monotonic()
+        with self._cond:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                if len(self._buckets) >= 10000:
+                    self._prune_buckets(now)
+                bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+
+            if not bucket.take(now):
+                self._shed_rate_limit += 1
+                if bucket.warned:
+                    return SHED_SILENT
+                bucket.warned = True
+                return SHED_RATE_LIMIT
+            bucket.warned = False
+
+            if self._depth >= self.max_queue:
+                self._shed_overload += 1
+                return SHED_OVERLOAD
+
+            if queue_key is None:
+                queue_key = user_id
+            queue = self._queues.setdefault(queue_key, deque())
+            queue.append(job)
+            if len(queue) == 1 and queue_key not in self._active:
+                self._ready.append(queue_key)
+
+            self._admitted += 1
+            self._depth += 1
+            self._peak_depth = max(self._peak_depth, self._depth)
+            self._cond.notify()
+        return None
+
+    def _prune_buckets(self, now: float):
+        """Забывает пользователей с полным ведром - они давно ничего не присылали"""
+        idle = [user_id for user_id, bucket in self._buckets.items() if bucket.is_full(now)]
+        for user_id in idle:
+            del self._buckets[user_id]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                queue_key = self._ready.popleft()
+                job = self._queues[queue_key].popleft()
+                self._active.add(queue_key)
+                self._depth -= 1
+
+            try:
+                job()
+            except Exception as e:
+                logger.error(f"Ошибка обработки запроса (очередь {queue_key}): {e}")
+            finally:
+                with self._cond:
+                    self._active.discard(queue_key)
+                    # Следующая задача очереди встает в конец круга
+                    if self._queues[queue_key]:
+                        self._ready.append(queue_key)
+                        self._cond.notify()
+                    else:
+                        del self._queues[queue_key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Метрики: принято, отброшено по лимиту пользователя и по перегрузке, глубина очереди
+        """
+        with self._cond:
+            return {
+                'admitted': self._admitted,
+                'shed_rate_limit': self._shed_rate_limit,
+                'shed_overload': self._shed_overload,
+                'queue_depth': self._depth,
+                'peak_queue_depth': self._peak_depth,
+                'active': len(self._active),
+                'waiting_users': len(self._ready),
+                'tracked_users': len(self._buckets)
+            }
@@ -0,0 +1,232 @@
+"""
+Модуль ценовых уведомлений (алертов)
+Алерты хранятся в SQLite, а в памяти держится индекс порогов по каждой паре
+"""
+import bisect
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+from loguru import logger
+
+# Направления срабатывания алерта
+ABOVE = 'above'  # курс поднялся до порога или выше
+BELOW = 'below'  # курс опустился до порога или ниже
+
+class _ThresholdIndex:
+    """
+    Отсортированные пороги одного направления для одной пары.
+    Пороги и id лежат в параллельных массивах array - 16 байт на алерт
+    """
+
+    def __init__(self):
+        self.thresholds = array('d')
+        self.ids = array('q')
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, threshold: float, alert_id: int):
+        pos = bisect.bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(pos, threshold)
+        self.ids.insert(pos, alert_id)
+
+    def remove(self, threshold: float, alert_id: int) -> bool:
+        # Ищем только среди алертов с тем же порогом
+        lo = bisect.bisect_left(self.thresholds, threshold)
+        hi = bisect.bisect_right(self.thresholds, threshold)
+        for pos in range(lo, hi):
+            if self.ids[pos] == alert_id:
+                del self.thresholds[pos]
+                del self.ids[pos]
+                return True
+        return False
+
+    def pop_below(self, rate: float) -> List[int]:
+        """Снимает алерты с порогом <= rate (для направления ABOVE)"""
+        pos = bisect.bisect_right(self.thresholds, rate)
+        fired = self.ids[:pos].tolist()
+        del self.thresholds[:pos]
+        del self.ids[:pos]
+        return fired
+
+    def pop_above(self, rate: float) -> List[int]:
+        """Снимает алерты с порогом >= rate (для направления BELOW)"""
+        pos = bisect.bisect_left(self.thresholds, rate)
+        fired = self.ids[pos:].tolist()
+        del self.thresholds[pos:]
+        del self.ids[pos:]
+        return fired
+
+class AlertStore:
+    """
+    Хранилище алертов с индексом порогов.
+    При обновлении курса проверяются только пересеченные пороги,
+    без перебора всех алертов
+    """
+
+    def __init__(self, db_path: str, shard: Optional[Tuple[int, int]] = None):
+        """
+        Args:
+            db_path: Путь к файлу SQLite
+            shard: (номер, всего) - воркер держит в индексе только алерты своих чатов
+        """
+        self.shard = shard
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                from_currency TEXT NOT NULL,
+                to_currency TEXT NOT NULL,
+                direction TEXT NOT NULL,
+                threshold REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS alerts_user ON alerts (user_id)")
+        self._db.commit()
+
+        # (from, to) -> {направление: индекс порогов}
+        self._index: Dict[Tuple[str, str], Dict[str, _ThresholdIndex]] = {}
+        self._load_index()
+
+    def _load_index(self):
+        """Строит индекс порогов из базы при старте"""
+        query = "SELECT id, from_currency, to_currency, direction, threshold FROM alerts"
+        params: tuple = ()
+        if self.shard:
+            # Остаток как в Python: у групп chat_id отрицательный
+            index, count = self.shard
+            query += " WHERE ((chat_id % ?) + ?) % ? = ?"
+            params = (count, count, count, index)
+        rows = self._db.execute(query + " ORDER BY threshold", params)
+        count = 0
+        for alert_id, from_currency, to_currency, direction, threshold in rows:
+            # Строки уже отсортированы по порогу - добавление идет в конец массива
+            self._pair_index(from_currency, to_currency)[direction].add(threshold, alert_id)
+            count += 1
+        logger.info(f"Загружено алертов: {count}")
+
+    def _pair_index(self, from_currency: str, to_currency: str) -> Dict[str, _ThresholdIndex]:
+        pair = (from_currency, to_currency)
+        if pair not in self._index:
+            self._index[pair] = {ABOVE: _ThresholdIndex(), BELOW: _ThresholdIndex()}
+        return self._index[pair]
+
+    def add(self, user_id: int, chat_id: int, from_currency: str, to_currency: str,
+            direction: str, threshold: float) -> int:
+        """
+        Добавляет алерт
+
+        Returns:
+            int: Номер нового алерта
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO alerts (user_id, chat_id, from_currency, to_currency, direction, threshold, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, from_currency, to_currency, direction, threshold, time.time())
+            )
+            self._db.commit()
+            alert_id = cursor.lastrowid
+            self._pair_index(from_currency, to_currency)[direction].add(threshold, alert_id)
+            return alert_id
+
+    def remove(self, user_id: int, alert_id: int) -> bool:
+        """
+        Удаляет алерт пользователя
+
+        Returns:
+            bool: True если алерт найден и удален
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT from_currency, to_currency, direction, threshold FROM alerts WHERE id = ? AND user_id = ?",
+                (alert_id, user_id)
+            ).fetchone()
+            if not row:
+                return False
+
+            from_currency, to_currency, direction, threshold = row
+            self._db.execute("DELETE FROM alerts WHERE id = ?", (alert_id,))
+            self._db.commit()
+            self._pair_index(from_currency, to_currency)[direction].remove(threshold, alert_id)
+            return True
+
+    def list_for_user(self, user_id: int) -> List[dict]:
+        """
+        Возвращает алерты пользователя
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, from_currency, to_currency, direction, threshold FROM alerts "
+                "WHERE user_id = ? ORDER BY id",
+                (user_id,)
+            ).fetchall()
+        return [
+            {'id': r[0], 'from_currency': r[1], 'to_currency': r[2], 'direction': r[3], 'threshold': r[4]}
+            for r in rows
+        ]
+
+    def count_for_user(self, user_id: int) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM alerts WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def evaluate(self, rate_lookup: Callable[[str, str], Optional[float]]) -> List[dict]:
+        """
+        Проверяет алерты по свежим курсам.
+        Сработавшие алерты удаляются (они одноразовые) и возвращаются
+
+        Args:
+            rate_lookup: Функция (from, to) -> курс, обычно снимок CurrencyAPI
+
+        Returns:
+            List[dict]: Сработавшие алерты вместе с курсом срабатывания
+        """
+        with self._lock:
+            fired: Dict[int, float] = {}
+            for (from_currency, to_currency), sides in self._index.items():
+                if not len(sides[ABOVE]) and not len(sides[BELOW]):
+                    continue
+                rate = rate_lookup(from_currency, to_currency)
+                if not rate:
+                    continue
+                for alert_id in sides[ABOVE].pop_below(rate):
+                    fired[alert_id] = rate
+                for alert_id in sides[BELOW].pop_above(rate):
+                    fired[alert_id] = rate
+
+            if not fired:
+                return []
+
+            triggered = []
+            ids = list(fired)
+            # SQLite ограничивает число параметров в запросе - идем кусками
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT id, user_id, chat_id, from_currency, to_currency, direction, threshold "
+                    f"FROM alerts WHERE id IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                self._db.execute(f"DELETE FROM alerts WHERE id IN ({placeholders})", chunk)
+                for r in rows:
+                    triggered.append({
+                        'id': r[0], 'user_id': r[1], 'chat_id': r[2], 'from_currency': r[3],
+                        'to_currency': r[4], 'direction': r[5], 'threshold': r[6], 'rate': fired[r[0]]
+                    })
+            self._db.commit()
+
+        logger.info(f"Сработало алертов: {len(triggered)}")
+        return triggered
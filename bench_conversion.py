@@ -0,0 +1,75 @@
+"""
+Бенчмарк конвертации: прежний путь на float против пути бота после получения курса -
+CurrencyAPI.convert_currency (ConversionEngine.convert) и ConversionEngine.render
+Запуск: python bench_conversion.py
+"""
+import sys
+import timeit
+from decimal import Decimal
+
+from config import Config
+from conversion import ConversionEngine
+
+# Типичные запросы: (сумма, из, в, курс)
+QUERIES = [
+    ('100', 'USDT', 'UAH', 41.37),
+    ('50', 'USD', 'RUB', 92.415),
+    ('0.1', 'BTC', 'USD', 67012.5),
+    ('1000', 'UAH', 'EUR', 0.02215),
+    ('0.00001234', 'BTC', 'RUB', 6193120.0),
+    ('2500', 'TRX', 'USD', 0.1189),
+]
+
+def legacy_path(config: Config, amount: float, from_currency: str, to_currency: str, rate: float) -> str:
+    """Прежний _perform_conversion: float, поиск названий и сборка строки на каждый вызов"""
+    converted_amount = amount * rate
+    from_name = config.SUPPORTED_CURRENCIES[from_currency]
+    to_name = config.SUPPORTED_CURRENCIES[to_currency]
+
+    response = f"💱 Конвертация:\n\n"
+    response += f"📊 {amount:,.2f} {from_name}\n"
+    response += f"🔄 {converted_amount:,.2f} {to_name}\n\n"
+    response += f"📈 Курс: 1 {from_currency} = {rate:,.4f} {to_currency}"
+    return response
+
+def engine_path(engine: ConversionEngine, amount: Decimal, from_currency: str, to_currency: str, rate: float) -> str:
+    """Как CurrencyBot._conversion_reply: сумма из convert_currency, ответ по шаблону пары"""
+    converted_amount = engine.convert(amount, rate)
+    return engine.render('conversion', from_currency, to_currency, amount, converted_amount, rate)
+
+def main():
+    config = Config()
+    engine = ConversionEngine()
+    float_queries = [(float(a), f, t, r) for a, f, t, r in QUERIES]
+    decimal_queries = [(Decimal(a), f, t, r) for a, f, t, r in QUERIES]
+
+    def run_legacy():
+        for query in float_queries:
+            legacy_path(config, *query)
+
+    def run_engine():
+        for query in decimal_queries:
+            engine_path(engine, *query)
+
+    # Замеры чередуются, чтобы колебания частоты процессора доставались обоим путям
+    number = 20000
+    legacy_runs, engine_runs = [], []
+    for _ in range(9):
+        legacy_runs.append(timeit.timeit(run_legacy, number=number))
+        engine_runs.append(timeit.timeit(run_engine, number=number))
+    legacy = min(legacy_runs) / (number * len(QUERIES))
+    current = min(engine_runs) / (number * len(QUERIES))
+
+    print(f"float (прежний путь):  {legacy * 1e6:.2f} мкс/запрос")
+    print(f"ConversionEngine:      {current * 1e6:.2f} мкс/запрос")
+    print(f"Отношение:             {legacy / current:.2f}x")
+
+    print("\nПримеры ответов:")
+    for query in decimal_queries:
+        print(engine_path(engine, *query).splitlines()[3], "|", engine_path(engine, *query).splitlines()[5])
+
+    # Ненулевой код выхода, если движок медленнее прежнего пути
+    sys.exit(0 if current <= legacy else 1)
+
+if __name__ == "__main__":
+    main()
@@ -3,33 +3,151 @@
 Здесь вся логика обработки сообщений пользователей
 """
 import asyncio
+import functools
 import re
-from typing import Optional, Tuple
+import sys
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional, Tuple
 from telebot import TeleBot
-from telebot.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from telebot.types import Update, Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from loguru import logger
 
+from admission import SHED_OVERLOAD, SHED_SILENT, AdmissionController
+from alerts import ABOVE, BELOW, AlertStore
+from catalog import CRYPTO, FIAT
+from charts import ChartCache, render_chart
 from config import Config
 from currency_api import CurrencyAPI
+from notifications import BatchNotifier, CHAT_UNAVAILABLE
+from profiling import SamplingProfiler, tracer
+from rate_history import RateHistory
+from reply_cache import ReplyCache
+from subscriptions import DAILY, HOURLY, SubscriptionStore
+
+# Валюта в командах: код, название или алиас из каталога ("usdt", "гривна", "1inch")
+CURRENCY_TOKEN = r'([^\W_]{2,20})'
 
 class CurrencyBot:
     """
     Основной класс Telegram бота
     """
     
-    def __init__(self):
+    def __init__(self, shard: Optional[Tuple[int, int]] = None):
+        """
+        Args:
+            shard: (номер, всего) - бот работает воркером шарда: апдейты приходят
+                от ingress-процесса, курсы читаются из общего снимка
+        """
         # Инициализируем конфигурацию и API
         self.config = Config()
-        self.bot = TeleBot(self.config.BOT_TOKEN)
-        self.currency_api = CurrencyAPI()
+        self.shard = shard
+        # Воркер принимает апдейты шарда в одном потоке, а выполняет их пул admission:
+        # порядок сообщений одного чата сохраняет очередь admission по чату (см. _admitted)
+        self.bot = TeleBot(self.config.BOT_TOKEN, threaded=shard is None)
+        # Снимок курсов пишет процесс, который ходит в API; воркер его только читает
+        self.currency_api = CurrencyAPI(self.config.RATES_SNAPSHOT_PATH, read_only=shard is not None)
+        # Каталог валют: поиск по коду, названию и алиасам
+        self.catalog = self.currency_api.catalog
+        # Точная конвертация и готовые шаблоны ответов (тот же движок, что считает суммы)
+        self.conversion = self.currency_api.conversion
+        # Готовые ответы на одинаковые запросы в пределах одного снимка курсов
+        self.reply_cache = ReplyCache(self.config.REPLY_CACHE_SIZE)
+        # Клавиатуры выбора валют - до следующего изменения каталога
+        self.keyboard_cache = ReplyCache(self.config.KEYBOARD_CACHE_SIZE)
+        
+        # История курсов: пишется на каждом обновлении снимка
+        # (в шардированном режиме пишет только ingress, воркеры читают)
+        self.rate_history = RateHistory.from_config(self.config)
+        if shard is None:
+            self.currency_api.add_rate_listener(self._record_history)
+        self.chart_cache = ChartCache(self.config.CHART_CACHE_SIZE)
+        
+        # Ценовые уведомления: проверяются на каждом обновлении снимка курсов
+        self.alert_store = AlertStore(self.config.ALERTS_DB_PATH, shard=shard)
+        self.notifier = BatchNotifier(self.bot)
+        # Подписки на дайджесты курсов: рассылаются тем же пакетным отправителем
+        self.subscriptions = SubscriptionStore(self.config.SUBSCRIPTIONS_DB_PATH, shard=shard)
+        self.currency_api.add_rate_listener(self._on_rates_refreshed)
+        
+        # Контроль нагрузки: лимит на пользователя, общий лимит и справедливая очередь
+        self.admission = AdmissionController(
+            user_rate=self.config.USER_RATE_LIMIT,
+            user_burst=self.config.USER_BURST,
+            max_concurrency=self.config.MAX_CONCURRENT_REQUESTS,
+            max_queue=self.config.MAX_QUEUED_REQUESTS
+        )
+        
+        # Профилирование по запросу админа (/profile, /traces)
+        self.profiler = SamplingProfiler(self.config.PROFILE_DIR, self.config.PROFILE_INTERVAL)
         
         # Настраиваем логирование
-        logger.add("bot.log", rotation="1 MB", level="INFO")
+        log_file = "bot.log" if shard is None else f"bot.worker{shard[0]}.log"
+        logger.add(log_file, rotation="1 MB", level="INFO")
         logger.info("Бот инициализирован")
         
         # Регистрируем обработчики сообщений
         self._register_handlers()
     
+    def _is_admin(self, user_id: int) -> bool:
+        """Проверяет, что пользователь в списке админов (ADMIN_IDS)"""
+        return user_id in self.config.ADMIN_IDS
+    
+    def _admitted(self, handler):
+        """
+        Оборачивает обработчик: запрос проходит контроль нагрузки и выполняется
+        в справедливой очереди. Отказ - короткий ответ без запроса курсов.
+        Воркер шарда ведет очереди по чатам: сообщения разных пользователей
+        одной группы выполняются по порядку, как их раздал ingress
+        """
+        @functools.wraps(handler)
+        def wrapper(update):
+            submitted = time.perf_counter()
+            queue_key = self._chat_id(update) if self.shard else None
+            reason = self.admission.submit(
+                update.from_user.id, lambda: self._traced(handler, update, submitted), queue_key
+            )
+            if reason:
+                self._shed(update, reason)
+        return wrapper
+    
+    @staticmethod
+    def _chat_id(update) -> int:
+        """Чат апдейта (как sharding.shard_key): у кнопки - чат ее сообщения"""
+        if isinstance(update, CallbackQuery):
+            return update.message.chat.id if update.message else update.from_user.id
+        return update.chat.id
+    
+    def _traced(self, handler, update, submitted: float):
+        """
+        Выполняет обработчик в трассе (если трассировка включена)
+        
+        Args:
+            submitted: Когда апдейт встал в очередь (time.perf_counter)
+        """
+        trace = tracer.start(handler.__name__, time.perf_counter() - submitted) if tracer.enabled else None
+        try:
+            handler(update)
+        finally:
+            tracer.finish(trace)
+    
+    def _shed(self, update, reason: str):
+        """
+        Отвечает на отброшенный запрос (повторно превысившим лимит - не отвечаем)
+        """
+        if reason == SHED_SILENT:
+            return
+        
+        text = self.config.MESSAGES['overloaded' if reason == SHED_OVERLOAD else 'rate_limited']
+        try:
+            if isinstance(update, CallbackQuery):
+                self.bot.answer_callback_query(update.id, text)
+            else:
+                self.bot.reply_to(update, text)
+        except Exception as e:
+            logger.warning(f"Не удалось ответить на отброшенный запрос: {e}")
+    
     def _create_conversion_keyboard(self) -> InlineKeyboardMarkup:
         """
         Создает клавиатуру с популярными конвертациями
@@ -74,6 +192,7 @@ class CurrencyBot:
         """
         
         @self.bot.message_handler(commands=['start'])
+        @self._admitted
         def handle_start(message: Message):
             """Обработчик команды /start"""
             logger.info(f"Пользователь {message.from_user.id} запустил бота")
@@ -87,11 +206,13 @@ class CurrencyBot:
             )
         
         @self.bot.message_handler(commands=['help'])
+        @self._admitted
         def handle_help(message: Message):
             """Обработчик команды /help"""
             self.bot.reply_to(message, self.config.MESSAGES['help'])
         
         @self.bot.message_handler(commands=['rates'])
+        @self._admitted
         def handle_rates(message: Message):
             """Обработчик команды /rates - показывает актуальные курсы"""
             logger.info(f"Пользователь {message.from_user.id} запросил курсы")
@@ -101,15 +222,28 @@ class CurrencyBot:
             
             if rates:
                 response = "💱 Актуальные курсы к рублю:\n\n"
+                day_ago = time.time() - 24 * 3600
                 for currency, rate in rates.items():
-                    currency_name = self.config.SUPPORTED_CURRENCIES.get(currency, currency)
-                    response += f"{currency_name}: {rate:,.2f} ₽\n"
+                    currency_name = self.catalog.name(currency)
+                    response += f"{currency_name}: {rate:,.2f} ₽"
+                    # Изменение за сутки по локальной истории
+                    old_rate = self.rate_history.value_at(currency, 'RUB', day_ago)
+                    if old_rate:
+                        response += f" ({(rate / old_rate - 1) * 100:+.2f}% за 24ч)"
+                    response += "\n"
             else:
                 response = "❌ Не удалось получить курсы валют"
             
-            self.bot.reply_to(message, response)
+            # Кнопки графиков за неделю по тем же валютам
+            keyboard = InlineKeyboardMarkup(row_width=4)
+            keyboard.add(*[
+                InlineKeyboardButton(f"📈 {currency}", callback_data=f"chart_{currency}_RUB_7d")
+                for currency in rates
+            ])
+            self.bot.reply_to(message, response, reply_markup=keyboard if rates else None)
         
         @self.bot.message_handler(commands=['convert'])
+        @self._admitted
         def handle_convert_command(message: Message):
             """Обработчик команды /convert"""
             # Проверяем есть ли аргументы после команды
@@ -119,9 +253,10 @@ class CurrencyBot:
                 self._handle_convert(message, text)
             else:  # Если просто /convert без аргументов
                 logger.info("Convert command without args - showing currency selection")
-                self._send_currency_selection(message)
+                self._send_currency_selection(message, edit=False)
         
         @self.bot.message_handler(commands=['quick'])
+        @self._admitted
         def handle_quick_convert(message: Message):
             """Обработчик команды /quick - показывает кнопки для быстрой конвертации"""
             keyboard = self._create_conversion_keyboard()
@@ -131,7 +266,136 @@ class CurrencyBot:
                 reply_markup=keyboard
             )
         
+        @self.bot.message_handler(commands=['history'])
+        @self._admitted
+        def handle_history(message: Message):
+            """Обработчик команды /history - история курса пары за период"""
+            self._handle_history_command(message)
+        
+        @self.bot.message_handler(commands=['chart'])
+        @self._admitted
+        def handle_chart(message: Message):
+            """Обработчик команды /chart - график курса пары за период"""
+            parsed = self._parse_history_command(re.sub(r'^/chart(@\w+)?', '', message.text.strip()))
+            if not parsed:
+                self.bot.reply_to(message, self.config.MESSAGES['chart_format'])
+                return
+            self._send_chart(message.chat.id, *parsed)
+        
+        @self.bot.message_handler(commands=['alert'])
+        @self._admitted
+        def handle_alert(message: Message):
+            """Обработчик команды /alert - создает ценовое уведомление"""
+            self._handle_alert_command(message)
+        
+        @self.bot.message_handler(commands=['alerts'])
+        @self._admitted
+        def handle_alerts(message: Message):
+            """Обработчик команды /alerts - список уведомлений пользователя"""
+            alerts = self.alert_store.list_for_user(message.from_user.id)
+            if not alerts:
+                self.bot.reply_to(message, "🔕 У вас нет активных уведомлений.\n\n📝 Пример: `/alert BTC USD > 70000`")
+                return
+            
+            response = "🔔 Ваши уведомления:\n\n"
+            for alert in alerts:
+                response += f"#{alert['id']}: {self._format_alert(alert)}\n"
+            response += "\n🗑 Удалить: /unalert <номер>"
+            self.bot.reply_to(message, response)
+        
+        @self.bot.message_handler(commands=['unalert'])
+        @self._admitted
+        def handle_unalert(message: Message):
+            """Обработчик команды /unalert - удаляет уведомление"""
+            parts = message.text.split()
+            if len(parts) != 2 or not parts[1].lstrip('#').isdigit():
+                self.bot.reply_to(message, "❌ Укажите номер уведомления: `/unalert 12`")
+                return
+            
+            alert_id = int(parts[1].lstrip('#'))
+            if self.alert_store.remove(message.from_user.id, alert_id):
+                self.bot.reply_to(message, f"🗑 Уведомление #{alert_id} удалено")
+            else:
+                self.bot.reply_to(message, f"❌ Уведомление #{alert_id} не найдено")
+        
+        @self.bot.message_handler(commands=['subscribe'])
+        @self._admitted
+        def handle_subscribe(message: Message):
+            """Обработчик команды /subscribe - подписка на дайджест курсов"""
+            self._handle_subscribe_command(message)
+        
+        @self.bot.message_handler(commands=['subscriptions'])
+        @self._admitted
+        def handle_subscriptions(message: Message):
+            """Обработчик команды /subscriptions - список подписок пользователя"""
+            subscriptions = self.subscriptions.list_for_user(message.from_user.id)
+            if not subscriptions:
+                self.bot.reply_to(message, "📭 Подписок нет. Подписаться: `/subscribe BTC USD, USDT UAH daily 6`")
+                return
+            
+            response = "📬 Ваши подписки:\n\n"
+            for subscription in subscriptions:
+                response += f"#{subscription['id']} {self._format_subscription(subscription)}\n"
+            response += "\n🔕 Отписаться: /unsubscribe <номер> или /unsubscribe all"
+            self.bot.reply_to(message, response)
+        
+        @self.bot.message_handler(commands=['unsubscribe'])
+        @self._admitted
+        def handle_unsubscribe(message: Message):
+            """Обработчик команды /unsubscribe - удаляет подписку или все подписки"""
+            parts = message.text.split()
+            user_id = message.from_user.id
+            # Без номера можно, если подписка одна (ссылка из дайджеста)
+            remove_all = len(parts) == 2 and parts[1].lower() == 'all'
+            if remove_all or len(parts) == 1 and self.subscriptions.count_for_user(user_id) == 1:
+                removed = self.subscriptions.remove(user_id)
+                self.bot.reply_to(message, f"🔕 Удалено подписок: {removed}")
+                return
+            if len(parts) != 2 or not parts[1].lstrip('#').isdigit():
+                self.bot.reply_to(message, "❌ Укажите номер подписки: `/unsubscribe 3` или `/unsubscribe all`")
+                return
+            
+            subscription_id = int(parts[1].lstrip('#'))
+            if self.subscriptions.remove(user_id, subscription_id):
+                self.bot.reply_to(message, f"🔕 Подписка #{subscription_id} удалена")
+            else:
+                self.bot.reply_to(message, f"❌ Подписка #{subscription_id} не найдена")
+        
+        @self.bot.message_handler(commands=['stats'], func=lambda message: self._is_admin(message.from_user.id))
+        def handle_stats(message: Message):
+            """Обработчик команды /stats - метрики нагрузки (только для админов)"""
+            stats = self.admission.stats()
+            response = "📊 Нагрузка:\n\n"
+            response += f"✅ Принято: {stats['admitted']}\n"
+            response += f"🚫 Отброшено по лимиту пользователя: {stats['shed_rate_limit']}\n"
+            response += f"🔥 Отброшено при перегрузке: {stats['shed_overload']}\n"
+            response += f"📥 Очередь: {stats['queue_depth']} (пик {stats['peak_queue_depth']})\n"
+            response += f"⚙️ В работе: {stats['active']}, ждут: {stats['waiting_users']}\n"
+            response += f"👥 Пользователей в лимитере: {stats['tracked_users']}\n\n"
+            cache = self.reply_cache.stats()
+            response += f"💾 Кэш ответов: {cache['size']}, попаданий {cache['hits']}, промахов {cache['misses']}\n"
+            response += f"🔄 Снимок курсов #{cache['version']}, сбросов кэша: {cache['invalidations']}\n"
+            rates = self.currency_api.rates
+            if rates.updated_at:
+                fiat_as_of = time.strftime('%d.%m %H:%M', time.localtime(rates.fiat_as_of))
+                crypto_as_of = time.strftime('%d.%m %H:%M', time.localtime(rates.crypto_as_of))
+                response += f"🕒 Курсы: фиат {fiat_as_of} ({rates.sources[0]}), крипто {crypto_as_of} ({rates.sources[1]})\n"
+            digests = self.subscriptions.stats()
+            response += f"📬 Подписок: {digests['subscriptions']}, в очереди рассылки: {digests['outbox']}"
+            self.bot.reply_to(message, response)
+        
+        @self.bot.message_handler(commands=['profile'], func=lambda message: self._is_admin(message.from_user.id))
+        def handle_profile(message: Message):
+            """Обработчик команды /profile N - профиль процесса за N секунд (только для админов)"""
+            self._handle_profile_command(message)
+        
+        @self.bot.message_handler(commands=['traces'], func=lambda message: self._is_admin(message.from_user.id))
+        def handle_traces(message: Message):
+            """Обработчик команды /traces [on|off|clear|N] - медленные апдейты по этапам (только для админов)"""
+            self._handle_traces_command(message)
+        
         @self.bot.message_handler(func=lambda message: True)
+        @self._admitted
         def handle_all_messages(message: Message):
             """Обработчик всех остальных сообщений"""
             text = message.text.strip()
@@ -168,6 +432,7 @@ class CurrencyBot:
                 self.bot.reply_to(message, help_text)
         
         @self.bot.callback_query_handler(func=lambda call: True)
+        @self._admitted
         def handle_callback_query(call: CallbackQuery):
             """Обработчик нажатий на inline кнопки"""
             try:
@@ -180,6 +445,19 @@ class CurrencyBot:
                 elif data == "back_to_currencies":
                     # Возврат к выбору валютной пары
                     self._handle_back_to_currencies(call)
+                elif data.startswith("sel_"):
+                    # Листание списка валют: sel_fiat_2 или sel_crypto_0_USD (выбрана исходная)
+                    parts = data.split("_")
+                    from_currency = parts[3] if len(parts) > 3 else None
+                    self._send_currency_selection(call.message, from_currency, parts[1], int(parts[2]), edit=True)
+                elif data == "noop":
+                    # Номер страницы - просто надпись
+                    pass
+                elif data.startswith("chart_"):
+                    # График пары: chart_BTC_USD_7d
+                    parsed = self._parse_history_command(data[len("chart_"):].replace("_", " "))
+                    if parsed:
+                        self._send_chart(call.message.chat.id, *parsed)
                     
                 # Убираем "часики" с кнопки
                 self.bot.answer_callback_query(call.id)
@@ -198,8 +476,8 @@ class CurrencyBot:
         to_currency = template_parts[2].upper()
         
         # Получаем красивые названия валют
-        currency_from_name = self.config.SUPPORTED_CURRENCIES.get(from_currency, from_currency)
-        currency_to_name = self.config.SUPPORTED_CURRENCIES.get(to_currency, to_currency)
+        currency_from_name = self.catalog.name(from_currency)
+        currency_to_name = self.catalog.name(to_currency)
         
         # Создаем кнопку "Назад"
         keyboard = InlineKeyboardMarkup()
@@ -243,56 +521,97 @@ class CurrencyBot:
         Возвращает пользователя к выбору валютных пар
         """
         # Очищаем состояние пользователя если есть
-        if call.from_user.id in self._user_states:
-            del self._user_states[call.from_user.id]
+        self._clear_user_state(call.from_user.id)
         
-        # Показываем снова валютные пары
-        self._send_currency_selection(call.message)
+        # Показываем снова выбор валют в том же сообщении бота
+        self._send_currency_selection(call.message, edit=True)
     
-    def _send_currency_selection(self, message):
-        """
-        Отправляет пользователю выбор валютных пар
+    def _send_currency_selection(self, message, from_currency: Optional[str] = None,
+                                 kind: str = FIAT, page: int = 0, edit: bool = False):
         """
-        keyboard = InlineKeyboardMarkup()
+        Отправляет пользователю выбор валют из каталога постранично:
+        сначала исходная валюта, затем целевая
         
-        # Создаем популярные валютные пары
-        currency_pairs = [
-            ("USDT", "UAH", "💰 USDT → UAH"),
-            ("USD", "UAH", "💵 USD → UAH"),
-            ("EUR", "UAH", "💶 EUR → UAH"),
-            ("RUB", "UAH", "₽ RUB → UAH"), 
-            ("USDT", "USD", "💰 USDT → USD"),
-            ("BTC", "USD", "₿ BTC → USD"),
-            ("ETH", "USD", "⟠ ETH → USD"),
-            ("TON", "USD", "💎 TON → USD"),
-            ("TRX", "USD", "🔥 TRX → USD"),
-            ("RUB", "USD", "₽ RUB → USD")
-        ]
-        
-        # Добавляем кнопки для валютных пар
-        for from_curr, to_curr, display_name in currency_pairs:
-            callback_data = f"template_{from_curr.lower()}_{to_curr.lower()}"
-            keyboard.row(InlineKeyboardButton(display_name, callback_data=callback_data))
+        Args:
+            from_currency: Уже выбранная исходная валюта (None - выбираем ее)
+            kind: Вкладка списка (FIAT или CRYPTO)
+            page: Номер страницы
+            edit: Изменить message (сообщение бота с кнопками) вместо отправки нового.
+                Сообщение пользователя бот изменить не может
+        """
+        keyboard = self._selection_keyboard(from_currency, kind, page)
         
         # Создаем или изменяем сообщение
-        text = "💱 Выберите валютную пару для конвертации:\n\n"
-        text += "📊 Доступны актуальные курсы валют и криптовалют\n"
-        text += "⚡ После выбора введите сумму для конвертации"
+        if from_currency is None:
+            text = "💱 Выберите валюту, которую конвертируем:\n\n"
+            text += f"📊 Доступно валют: {len(self.catalog)}\n"
+            text += "⚡ Можно и без кнопок: `/convert 100 USD to EUR`"
+        else:
+            text = f"💱 {self.catalog.name(from_currency)} → выберите валюту, в которую конвертируем:"
         
-        if hasattr(message, 'message_id'):  # Это callback query
+        if edit:
             self.bot.edit_message_text(
                 text=text,
                 chat_id=message.chat.id,
                 message_id=message.message_id,
                 reply_markup=keyboard
             )
-        else:  # Это обычное сообщение
+        else:
             self.bot.send_message(
                 chat_id=message.chat.id,
                 text=text,
                 reply_markup=keyboard
             )
     
+    def _selection_keyboard(self, from_currency: Optional[str], kind: str, page: int) -> InlineKeyboardMarkup:
+        """
+        Страница клавиатуры выбора валют. Готовые клавиатуры кэшируются
+        до следующего изменения каталога
+        """
+        key = (from_currency, kind, page)
+        keyboard = self.keyboard_cache.get(key, self.catalog.version)
+        if keyboard is not None:
+            return keyboard
+        
+        suffix = f"_{from_currency}" if from_currency else ""
+        codes = [code for code in self.catalog.codes(kind) if code != from_currency]
+        page_size = self.config.SELECTION_PAGE_SIZE
+        pages = max(1, (len(codes) + page_size - 1) // page_size)
+        page = min(max(page, 0), pages - 1)
+        
+        keyboard = InlineKeyboardMarkup(row_width=self.config.SELECTION_ROW_WIDTH)
+        
+        # Вкладки: фиатные валюты и криптовалюты
+        keyboard.row(*[
+            InlineKeyboardButton(("• " if tab == kind else "") + title, callback_data=f"sel_{tab}_0{suffix}")
+            for tab, title in ((FIAT, "💵 Валюты"), (CRYPTO, "🪙 Криптовалюты"))
+        ])
+        
+        # Кнопки валют: исходная ведет к выбору целевой, целевая - к вводу суммы
+        buttons = []
+        for code in codes[page * page_size:(page + 1) * page_size]:
+            if from_currency is None:
+                callback_data = f"sel_{FIAT}_0_{code}"
+            else:
+                callback_data = f"template_{from_currency.lower()}_{code.lower()}"
+            buttons.append(InlineKeyboardButton(code, callback_data=callback_data))
+        keyboard.add(*buttons)
+        
+        # Листание страниц
+        if pages > 1:
+            keyboard.row(
+                InlineKeyboardButton("◀️", callback_data=f"sel_{kind}_{(page - 1) % pages}{suffix}"),
+                InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="noop"),
+                InlineKeyboardButton("▶️", callback_data=f"sel_{kind}_{(page + 1) % pages}{suffix}")
+            )
+        
+        if from_currency is not None:
+            back_kind = CRYPTO if self.catalog.is_crypto(from_currency) else FIAT
+            keyboard.row(InlineKeyboardButton("🔙 Другая исходная валюта", callback_data=f"sel_{back_kind}_0"))
+        
+        self.keyboard_cache.put(key, self.catalog.version, keyboard)
+        return keyboard
+    
     def _save_user_state(self, user_id: int, from_currency: str, to_currency: str):
         """
         Сохраняет состояние пользователя (какую валютную пару он выбрал)
@@ -322,7 +641,10 @@ class CurrencyBot:
         try:
             # Пробуем парсить введенную сумму
             amount_text = message.text.strip().replace(',', '.')
-            amount = float(amount_text)
+            with tracer.span('parse'):
+                amount = Decimal(amount_text)
+            if not amount.is_finite():
+                raise ValueError(amount_text)
             
             if amount <= 0:
                 self.bot.reply_to(message, "❌ Сумма должна быть больше нуля. Попробуйте еще раз:")
@@ -351,7 +673,7 @@ class CurrencyBot:
                 reply_markup=keyboard
             )
             
-        except ValueError:
+        except (ValueError, InvalidOperation):
             # Если не удалось парсить число
             self.bot.reply_to(
                 message, 
@@ -365,129 +687,65 @@ class CurrencyBot:
         if hasattr(self, '_user_states') and user_id in self._user_states:
             del self._user_states[user_id]
     
-    def _handle_template_selection(self, call: CallbackQuery):
+    def _conversion_reply(self, kind: str, amount: Decimal, from_currency: str, to_currency: str) -> Optional[str]:
         """
-        Обрабатывает выбор валютной пары и предлагает ввести сумму вручную
-        """
-        # Извлекаем валюты из callback_data
-        template_parts = call.data.split("_")  # ['template', 'usdt', 'uah']
-        from_currency = template_parts[1].upper()
-        to_currency = template_parts[2].upper()
-        
-        # Получаем красивые названия валют
-        currency_from_name = self.config.SUPPORTED_CURRENCIES.get(from_currency, from_currency)
-        currency_to_name = self.config.SUPPORTED_CURRENCIES.get(to_currency, to_currency)
-        
-        # Создаем кнопку "Назад"
-        keyboard = InlineKeyboardMarkup()
-        keyboard.row(InlineKeyboardButton("🔙 Выбрать другую пару", callback_data="back_to_currencies"))
-        
-        # Сохраняем выбранную пару в сообщении для последующей обработки
-        new_text = f"💱 Выбрана пара: {currency_from_name} → {currency_to_name}\n\n"
-        new_text += f"💰 Введите сумму в {from_currency}:\n\n"
-        new_text += f"📝 Примеры:\n"
-        
-        # Добавляем примеры сумм в зависимости от валюты
-        if from_currency == "USDT":
-            new_text += "• 100 (для 100 USDT)\n• 50.5 (для 50.5 USDT)"
-        elif from_currency == "USD":
-            new_text += "• 100 (для 100 USD)\n• 25.75 (для 25.75 USD)"
-        elif from_currency == "EUR":
-            new_text += "• 50 (для 50 EUR)\n• 75.25 (для 75.25 EUR)"
-        elif from_currency == "UAH":
-            new_text += "• 1000 (для 1000 UAH)\n• 2500 (для 2500 UAH)"
-        elif from_currency in ["BTC", "ETH"]:
-            new_text += "• 0.1 (для 0.1 BTC)\n• 0.025 (для 0.025 BTC)"
-        elif from_currency in ["TRX", "TON"]:
-            new_text += "• 1000 (для 1000 TRX)\n• 5000 (для 5000 TRX)"
-        else:
-            new_text += "• 100 (для 100)\n• 50.5 (для 50.5)"
-        
-        new_text += f"\n\n⚡ Просто напишите число!"
-        
-        self.bot.edit_message_text(
-            text=new_text,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=keyboard
-        )
+        Текст ответа о конвертации. Одинаковые запросы в пределах одного снимка
+        курсов берутся из кэша - без конвертации и форматирования
         
-        # Сохраняем состояние пользователя (ждем ввод суммы)
-        self._save_user_state(call.from_user.id, from_currency, to_currency)
-    
-    def _handle_back_to_currencies(self, call: CallbackQuery):
-        """
-        Возвращает к выбору валютной пары
+        Args:
+            kind: Шаблон ответа ('conversion', 'conversion_callback')
+            
+        Returns:
+            str: Готовый ответ или None если курс получить не удалось
         """
-        keyboard = self._create_conversion_keyboard()
-        new_text = "💱 Выберите валютную пару для быстрой конвертации:"
+        # Сумма в ключе уже нормализована: Decimal('100') и Decimal('100.0') - один ключ
+        key = (kind, from_currency, to_currency, amount)
+        # Кэшируем только ответы по свежему снимку; курс по отдельному запросу
+        # к API (снимок устарел) снимком не версионируется
+        version = self.currency_api.snapshot_version if self.currency_api.is_snapshot_fresh() else None
+        if version is not None:
+            with tracer.span('reply_cache'):
+                response = self.reply_cache.get(key, version)
+            if response is not None:
+                return response
         
-        # Очищаем состояние пользователя если есть
-        self._clear_user_state(call.from_user.id)
-        
-        self.bot.edit_message_text(
-            text=new_text,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=keyboard
-        )
-    
-    def _is_quick_convert(self, text: str) -> bool:
-        """
-        Проверяет, является ли текст быстрой конвертацией
-        """
-        # Убрать эту функцию или добавить логику проверки
-        return False
-    
-    def _handle_back_to_currencies(self, call: CallbackQuery):
-        """
-        Возвращает к выбору валютной пары
-        """
-        keyboard = self._create_conversion_keyboard()
-        new_text = "💱 Выберите валютную пару для быстрой конвертации:"
+        # Запускаем асинхронную конвертацию (внутри - этап rate_lookup, снаружи - накладные asyncio.run)
+        with tracer.span('asyncio.run'):
+            result = asyncio.run(self.currency_api.convert_currency(amount, from_currency, to_currency))
+        if not result:
+            return None
         
-        self.bot.edit_message_text(
-            text=new_text,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=keyboard
-        )
+        converted_amount, exchange_rate = result
+        # Форматируем ответ по готовому шаблону пары
+        with tracer.span('format'):
+            response = self.conversion.render(kind, from_currency, to_currency, amount, converted_amount, exchange_rate)
+        if version is not None:
+            self.reply_cache.put(key, version, response)
+        return response
     
-    def _perform_conversion_callback(self, call: CallbackQuery, amount: float, from_currency: str, to_currency: str):
+    def _perform_conversion_callback(self, call: CallbackQuery, amount: Decimal, from_currency: str, to_currency: str):
         """
         Выполняет конвертацию валют для callback запроса
         """
         try:
             logger.info(f"Callback конвертация: {amount} {from_currency} в {to_currency}")
             
-            # Запускаем асинхронную конвертацию
-            result = asyncio.run(self.currency_api.convert_currency(amount, from_currency, to_currency))
+            response = self._conversion_reply('conversion_callback', amount, from_currency, to_currency)
             
-            if result:
-                converted_amount, exchange_rate = result
-                
-                # Форматируем ответ
-                from_name = self.config.SUPPORTED_CURRENCIES[from_currency]
-                to_name = self.config.SUPPORTED_CURRENCIES[to_currency]
-                
-                response = f"💱 Конвертация выполнена!\n\n"
-                response += f"📊 {amount:,.2f} {from_name}\n"
-                response += f"🔄 {converted_amount:,.2f} {to_name}\n\n"
-                response += f"📈 Курс: 1 {from_currency} = {exchange_rate:,.4f} {to_currency}\n\n"
-                response += "💡 Хотите еще конвертацию? Нажмите /quick"
-                
+            if response:
                 # Создаем новую клавиатуру для повтора
                 keyboard = InlineKeyboardMarkup()
                 keyboard.row(InlineKeyboardButton("🔄 Еще конвертация", callback_data="back_to_currencies"))
                 
-                self.bot.edit_message_text(
-                    text=response,
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    reply_markup=keyboard
-                )
+                with tracer.span('send'):
+                    self.bot.edit_message_text(
+                        text=response,
+                        chat_id=call.message.chat.id,
+                        message_id=call.message.message_id,
+                        reply_markup=keyboard
+                    )
                 
-                logger.info(f"Успешная callback конвертация: {amount} {from_currency} = {converted_amount} {to_currency}")
+                logger.info(f"Успешная callback конвертация: {amount} {from_currency} в {to_currency}")
                 
             else:
                 self.bot.edit_message_text(
@@ -509,22 +767,23 @@ class CurrencyBot:
         Проверяет, является ли сообщение быстрой конвертацией
         Примеры: "100 USD", "0.5 BTC", "50 EUR"
         """
-        pattern = r'^\d+(?:\.\d+)?\s+[A-Z]{3,4}$'
-        return bool(re.match(pattern, text.upper()))
+        pattern = r'^\d+(?:[.,]\d+)?\s+' + CURRENCY_TOKEN + r'$'
+        match = re.match(pattern, text)
+        return bool(match) and self.catalog.resolve(match.group(1)) is not None
     
     def _handle_quick_convert(self, message: Message, text: str):
         """
         Обрабатывает быструю конвертацию в рубли
         """
         try:
-            parts = text.upper().split()
-            amount = float(parts[0])
-            from_currency = parts[1]
+            parts = text.split()
+            amount = Decimal(parts[0].replace(',', '.'))
+            from_currency = self._resolve_currency(parts[1])
             
             # Конвертируем в рубли по умолчанию
             self._perform_conversion(message, amount, from_currency, self.config.DEFAULT_TARGET_CURRENCY)
             
-        except (ValueError, IndexError) as e:
+        except (ValueError, IndexError, InvalidOperation) as e:
             logger.error(f"Ошибка парсинга быстрой конвертации: {e}")
             self.bot.reply_to(message, self.config.MESSAGES['invalid_format'])
     
@@ -534,7 +793,8 @@ class CurrencyBot:
         Примеры: "/convert 100 USD to EUR", "/convert 0.5 BTC to RUB"
         """
         # Парсим команду конвертации
-        parsed = self._parse_convert_command(text)
+        with tracer.span('parse'):
+            parsed = self._parse_convert_command(text)
         
         if not parsed:
             self.bot.reply_to(message, self.config.MESSAGES['invalid_format'])
@@ -543,25 +803,25 @@ class CurrencyBot:
         amount, from_currency, to_currency = parsed
         self._perform_conversion(message, amount, from_currency, to_currency)
     
-    def _parse_convert_command(self, text: str) -> Optional[Tuple[float, str, str]]:
+    def _parse_convert_command(self, text: str) -> Optional[Tuple[Decimal, str, str]]:
         """
         Парсит команду конвертации
         
         Returns:
-            Tuple[float, str, str]: (сумма, исходная_валюта, целевая_валюта)
+            Tuple[Decimal, str, str]: (сумма, исходная_валюта, целевая_валюта)
         """
         try:
             # Убираем /convert и разбиваем на части
             text = text.replace('/convert', '').strip()
             
-            # Паттерн: "100 USD to EUR" (регистронезависимый)
-            pattern = r'(\d+(?:\.\d+)?)\s+([a-zA-Z]{3,4})\s+(?:to|TO)\s+([a-zA-Z]{3,4})'
+            # Паттерн: "100 USD to EUR", "100 долларов в гривны" (регистронезависимый)
+            pattern = r'(\d+(?:[.,]\d+)?)\s+' + CURRENCY_TOKEN + r'\s+(?:to|в|in)\s+' + CURRENCY_TOKEN
             match = re.match(pattern, text, re.IGNORECASE)
             
             if match:
-                amount = float(match.group(1))
-                from_currency = match.group(2).upper()
-                to_currency = match.group(3).upper()
+                amount = Decimal(match.group(1).replace(',', '.'))
+                from_currency = self._resolve_currency(match.group(2))
+                to_currency = self._resolve_currency(match.group(3))
                 
                 logger.info(f"Parsed convert command: {amount} {from_currency} -> {to_currency}")
                 return amount, from_currency, to_currency
@@ -569,49 +829,442 @@ class CurrencyBot:
             logger.warning(f"Failed to parse convert command: '{text}'")
             return None
             
-        except (ValueError, AttributeError) as e:
+        except (ValueError, AttributeError, InvalidOperation) as e:
             logger.error(f"Ошибка парсинга команды конвертации: {e}")
             return None
     
-    def _perform_conversion(self, message: Message, amount: float, from_currency: str, to_currency: str):
+    def _resolve_currency(self, text: str) -> str:
+        """Код валюты по коду, названию или алиасу; неизвестная - как есть, в верхнем регистре"""
+        return self.catalog.resolve(text) or text.upper()
+    
+    def _unsupported_currency(self, *currencies: str) -> Optional[str]:
+        """
+        Проверяет валюты по каталогу
+        
+        Returns:
+            str: Ошибка с подсказками для первой неизвестной валюты или None если все известны
+        """
+        for currency in currencies:
+            if currency in self.catalog:
+                continue
+            # Подсказки по самому длинному префиксу, который есть в каталоге
+            suggestions = []
+            prefix = currency
+            while len(prefix) >= 2 and not suggestions:
+                suggestions = self.catalog.suggest(prefix)
+                prefix = prefix[:-1]
+            hint = f"\n💡 Возможно: {', '.join(suggestions)}" if suggestions else ""
+            return self.config.MESSAGES['unsupported_currency'].format(currency=currency, suggestions=hint)
+        return None
+    
+    def _parse_alert_command(self, text: str) -> Optional[Tuple[str, str, str, float]]:
+        """
+        Парсит команду алерта
+        Примеры: "/alert BTC USD > 70000", "/alert USDT/UAH < 40"
+        
+        Returns:
+            Tuple[str, str, str, float]: (исходная_валюта, целевая_валюта, направление, порог)
+        """
+        text = re.sub(r'^/alert(@\w+)?', '', text.strip()).strip()
+        pattern = (CURRENCY_TOKEN + r'\s*(?:/|\s+(?:to|в)\s+|\s+)' + CURRENCY_TOKEN
+                   + r'\s*([<>])\s*(\d+(?:[.,]\d+)?)$')
+        match = re.match(pattern, text, re.IGNORECASE)
+        if not match:
+            return None
+        
+        direction = ABOVE if match.group(3) == '>' else BELOW
+        threshold = float(match.group(4).replace(',', '.'))
+        return self._resolve_currency(match.group(1)), self._resolve_currency(match.group(2)), direction, threshold
+    
+    def _format_alert(self, alert: dict) -> str:
+        """Текстовое описание алерта, например: BTC → USD > 70,000.0000"""
+        sign = '>' if alert['direction'] == ABOVE else '<'
+        return f"{alert['from_currency']} → {alert['to_currency']} {sign} {alert['threshold']:,.4f}"
+    
+    def _handle_alert_command(self, message: Message):
+        """
+        Создает ценовое уведомление пользователя
+        """
+        parsed = self._parse_alert_command(message.text)
+        if not parsed:
+            self.bot.reply_to(message, self.config.MESSAGES['alert_format'])
+            return
+        
+        from_currency, to_currency, direction, threshold = parsed
+        error_msg = self._unsupported_currency(from_currency, to_currency)
+        if error_msg:
+            self.bot.reply_to(message, error_msg)
+            return
+        
+        user_id = message.from_user.id
+        if self.alert_store.count_for_user(user_id) >= self.config.MAX_ALERTS_PER_USER:
+            self.bot.reply_to(message, self.config.MESSAGES['alert_limit'].format(limit=self.config.MAX_ALERTS_PER_USER))
+            return
+        
+        alert_id = self.alert_store.add(user_id, message.chat.id, from_currency, to_currency, direction, threshold)
+        logger.info(f"Пользователь {user_id} создал алерт #{alert_id}: {from_currency}->{to_currency} {direction} {threshold}")
+        
+        alert = {'from_currency': from_currency, 'to_currency': to_currency, 'direction': direction, 'threshold': threshold}
+        response = f"🔔 Уведомление #{alert_id} создано:\n{self._format_alert(alert)}"
+        
+        current_rate = self.currency_api.get_snapshot_rate(from_currency, to_currency)
+        if current_rate:
+            response += f"\n\n📈 Сейчас: 1 {from_currency} = {current_rate:,.4f} {to_currency}"
+        self.bot.reply_to(message, response)
+    
+    def _parse_history_command(self, text: str) -> Optional[Tuple[str, str, int, str]]:
+        """
+        Парсит команду истории
+        Примеры: "/history BTC USD 7d", "/history USDT/UAH 24h", "/history EUR RUB"
+        
+        Returns:
+            Tuple[str, str, int, str]: (исходная_валюта, целевая_валюта, период_в_секундах, период_текстом)
+        """
+        text = re.sub(r'^/history(@\w+)?', '', text.strip()).strip()
+        pattern = CURRENCY_TOKEN + r'\s*(?:/|\s+(?:to|в)\s+|\s+)' + CURRENCY_TOKEN + r'(?:\s+(\d+)([a-zA-Z]))?$'
+        match = re.match(pattern, text, re.IGNORECASE)
+        if not match:
+            return None
+        
+        count, unit = (int(match.group(3)), match.group(4).lower()) if match.group(3) else (24, 'h')
+        if unit not in self.config.HISTORY_PERIOD_UNITS or count <= 0:
+            return None
+        
+        period = min(count * self.config.HISTORY_PERIOD_UNITS[unit], self.config.HISTORY_RETENTION)
+        return self._resolve_currency(match.group(1)), self._resolve_currency(match.group(2)), period, f"{count}{unit}"
+    
+    def _handle_history_command(self, message: Message):
+        """
+        Показывает изменение курса пары за период по локальной истории
+        """
+        parsed = self._parse_history_command(message.text)
+        if not parsed:
+            self.bot.reply_to(message, self.config.MESSAGES['history_format'])
+            return
+        
+        from_currency, to_currency, period, period_text = parsed
+        error_msg = self._unsupported_currency(from_currency, to_currency)
+        if error_msg:
+            self.bot.reply_to(message, error_msg)
+            return
+        
+        points = self.rate_history.range(from_currency, to_currency, time.time() - period)
+        if not points:
+            self.bot.reply_to(message, f"📭 Пока нет истории по паре {from_currency} → {to_currency}")
+            return
+        
+        first_ts, first_rate = points[0]
+        last_rate = points[-1][1]
+        rates = [rate for _, rate in points]
+        
+        response = f"📜 История {from_currency} → {to_currency} за {period_text}:\n\n"
+        response += f"🕐 Начало ({time.strftime('%d.%m %H:%M', time.gmtime(first_ts))} UTC): {first_rate:,.4f}\n"
+        response += f"📈 Сейчас: {last_rate:,.4f}\n"
+        response += f"📊 Изменение: {(last_rate / first_rate - 1) * 100:+.2f}%\n\n"
+        response += f"⬇️ Мин: {min(rates):,.4f}\n"
+        response += f"⬆️ Макс: {max(rates):,.4f}"
+        
+        keyboard = InlineKeyboardMarkup()
+        keyboard.row(InlineKeyboardButton(
+            "📈 График", callback_data=f"chart_{from_currency}_{to_currency}_{period_text}"
+        ))
+        self.bot.reply_to(message, response, reply_markup=keyboard)
+    
+    def _send_chart(self, chat_id: int, from_currency: str, to_currency: str, period: int, period_text: str):
+        """
+        Отправляет график курса пары.
+        Картинка кэшируется до следующего обновления курсов, а уже загруженная
+        в Telegram отправляется повторно по file_id без загрузки
+        """
+        error_msg = self._unsupported_currency(from_currency, to_currency)
+        if error_msg:
+            self.bot.send_message(chat_id, error_msg)
+            return
+        
+        key = (from_currency, to_currency, period_text, self.currency_api.rates_updated_at)
+        cached = self.chart_cache.get(key)
+        if cached and cached['file_id']:
+            self.bot.send_photo(chat_id, cached['file_id'], caption=cached['caption'])
+            return
+        
+        if cached:
+            png, caption = cached['png'], cached['caption']
+        else:
+            points = self.rate_history.range(from_currency, to_currency, time.time() - period)
+            if len(points) < 2:
+                self.bot.send_message(chat_id, f"📭 Пока мало истории по паре {from_currency} → {to_currency}")
+                return
+            
+            png = render_chart(points, self.config.CHART_WIDTH, self.config.CHART_HEIGHT)
+            first_rate, last_rate = points[0][1], points[-1][1]
+            caption = f"📈 {from_currency} → {to_currency} за {period_text}\n"
+            caption += f"{first_rate:,.4f} → {last_rate:,.4f} ({(last_rate / first_rate - 1) * 100:+.2f}%)"
+            self.chart_cache.put(key, png, caption)
+        
+        sent = self.bot.send_photo(chat_id, png, caption=caption)
+        if sent and sent.photo:
+            self.chart_cache.set_file_id(key, sent.photo[-1].file_id)
+    
+    def _handle_profile_command(self, message: Message):
+        """
+        Запускает сэмплирующий профайлер на N секунд: /profile 10 (CPU) или
+        /profile 10 wall (реальное время, с ожидающими потоками).
+        По окончании файл профиля (folded stacks) отправляется админу
+        """
+        args = message.text.split()[1:]
+        wall = bool(args) and args[-1].lower() == 'wall'
+        if wall:
+            args = args[:-1]
+        try:
+            seconds = float(args[0]) if args else 10.0
+        except ValueError:
+            self.bot.reply_to(message, "❌ Используйте: `/profile 10` (секунды) или `/profile 10 wall`")
+            return
+        seconds = min(max(seconds, 1.0), self.config.PROFILE_MAX_SECONDS)
+        mode = 'wall' if wall else 'cpu'
+        chat_id = message.chat.id
+        
+        def on_done(path: Optional[str], samples: int):
+            if path is None:
+                self.bot.send_message(chat_id, "❌ Не удалось снять профиль, подробности в логе")
+                return
+            try:
+                with open(path, 'rb') as f:
+                    self.bot.send_document(
+                        chat_id, f, caption=f"🔬 Профиль ({mode}): {samples} выборок\n{path}"
+                    )
+            except Exception as e:
+                logger.error(f"Не удалось отправить профиль: {e}")
+                self.bot.send_message(chat_id, f"🔬 Профиль записан: {path}")
+        
+        if not self.profiler.start(seconds, on_done, wall=wall):
+            self.bot.reply_to(message, "⏳ Профилирование уже идет")
+            return
+        logger.info(f"Админ {message.from_user.id} запустил профилирование ({mode}) на {seconds:g} с")
+        self.bot.reply_to(message, f"🔬 Снимаю профиль ({mode}) {seconds:g} с...")
+    
+    def _handle_traces_command(self, message: Message):
+        """
+        Показывает самые медленные трассы апдейтов или включает/выключает трассировку
+        """
+        args = message.text.split()[1:]
+        arg = args[0].lower() if args else ''
+        if arg in ('on', 'off'):
+            tracer.enabled = arg == 'on'
+            self.bot.reply_to(message, f"🧵 Трассировка {'включена' if tracer.enabled else 'выключена'}")
+            return
+        if arg == 'clear':
+            tracer.clear()
+            self.bot.reply_to(message, "🧹 Буфер трасс очищен")
+            return
+        
+        limit = int(arg) if arg.isdigit() else 5
+        traces = tracer.slowest(limit)
+        response = f"🧵 Трассировка {'включена' if tracer.enabled else 'выключена'}, "
+        response += f"трасс: {tracer.traced}, порог {self.config.TRACE_SLOW_MS:g} мс\n\n"
+        if traces:
+            response += '\n\n'.join(trace.format() for trace in traces)
+        else:
+            response += "Медленных апдейтов нет. Включить: /traces on"
+        # Лимит Telegram на длину сообщения
+        self.bot.reply_to(message, response[:4000])
+    
+    def _parse_subscribe_command(self, text: str) -> Optional[Tuple[List[Tuple[str, str]], str, int]]:
+        """
+        Парсит команду подписки
+        Примеры: "/subscribe BTC USD, USDT UAH daily 6", "/subscribe EUR/RUB hourly", "/subscribe TON USD"
+        
+        Returns:
+            Tuple[List[Tuple[str, str]], str, int]: (пары, расписание, час_UTC)
+        """
+        text = re.sub(r'^/subscribe(@\w+)?', '', text.strip()).strip()
+        schedule, hour = DAILY, self.config.DIGEST_DEFAULT_HOUR
+        
+        # Расписание и час - в конце команды
+        pattern = r'\s+(' + '|'.join(self.config.DIGEST_SCHEDULES) + r')(?:\s+(\d{1,2}))?$'
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            schedule = self.config.DIGEST_SCHEDULES[match.group(1).lower()]
+            if match.group(2):
+                hour = int(match.group(2))
+            if hour > 23:
+                return None
+            text = text[:match.start()]
+        if schedule == HOURLY:
+            hour = 0
+        
+        pair_pattern = CURRENCY_TOKEN + r'\s*(?:/|\s+(?:to|в)\s+|\s+)' + CURRENCY_TOKEN
+        pairs = []
+        for part in text.split(','):
+            pair_match = re.fullmatch(pair_pattern, part.strip(), re.IGNORECASE)
+            if not pair_match:
+                return None
+            pairs.append((self._resolve_currency(pair_match.group(1)), self._resolve_currency(pair_match.group(2))))
+        return pairs, schedule, hour
+    
+    def _format_subscription(self, subscription: dict) -> str:
+        """Описание подписки: BTC → USD, USDT → UAH - ежедневно в 06:00 UTC"""
+        pairs = ', '.join(f"{from_currency} → {to_currency}" for from_currency, to_currency in subscription['pairs'])
+        if subscription['schedule'] == HOURLY:
+            schedule = "каждый час"
+        else:
+            schedule = f"ежедневно в {subscription['hour']:02d}:00 UTC"
+        return f"{pairs} - {schedule}"
+    
+    def _handle_subscribe_command(self, message: Message):
+        """
+        Создает подписку на дайджест курсов
+        """
+        parsed = self._parse_subscribe_command(message.text)
+        if not parsed:
+            self.bot.reply_to(message, self.config.MESSAGES['subscribe_format'])
+            return
+        
+        pairs, schedule, hour = parsed
+        if len(set(pairs)) > self.config.DIGEST_MAX_PAIRS:
+            self.bot.reply_to(message, f"❌ Не больше {self.config.DIGEST_MAX_PAIRS} пар в одной подписке")
+            return
+        error_msg = self._unsupported_currency(*[currency for pair in pairs for currency in pair])
+        if error_msg:
+            self.bot.reply_to(message, error_msg)
+            return
+        
+        user_id = message.from_user.id
+        if self.subscriptions.count_for_user(user_id) >= self.config.MAX_SUBSCRIPTIONS_PER_USER:
+            self.bot.reply_to(message, self.config.MESSAGES['subscription_limit'].format(limit=self.config.MAX_SUBSCRIPTIONS_PER_USER))
+            return
+        
+        locale = self._user_locale(message)
+        subscription_id = self.subscriptions.add(user_id, message.chat.id, pairs, schedule, hour, locale)
+        logger.info(f"Пользователь {user_id} подписался на дайджест #{subscription_id}: {pairs} {schedule} {hour}")
+        
+        subscription = {'pairs': sorted(set(pairs)), 'schedule': schedule, 'hour': hour}
+        self.bot.reply_to(message, f"📬 Подписка #{subscription_id} создана:\n{self._format_subscription(subscription)}")
+    
+    def _user_locale(self, message: Message) -> str:
+        """Язык дайджеста по языку Telegram пользователя (есть тексты только для ru и en)"""
+        language = (message.from_user.language_code or '').lower()
+        return 'en' if language.startswith('en') else 'ru'
+    
+    def _render_digest(self, pairs: List[Tuple[str, str]], locale: str, slot: int) -> Optional[str]:
+        """
+        Текст дайджеста по текущему снимку курсов. Рендерится один раз
+        на (набор пар, язык, слот) и уходит всем подписчикам с таким набором
+        
+        Returns:
+            str: Текст или None если снимок устарел (попробуем в следующий раз)
+        """
+        if not self.currency_api.is_snapshot_fresh():
+            return None
+        
+        texts = self.config.DIGEST_TEXTS.get(locale, self.config.DIGEST_TEXTS['ru'])
+        lines = [texts['header'].format(time=time.strftime('%d.%m %H:%M', time.gmtime(slot)))]
+        day_ago = time.time() - 24 * 3600
+        for from_currency, to_currency in pairs:
+            rate = self.currency_api.get_snapshot_rate(from_currency, to_currency)
+            if not rate:
+                lines.append(f"{from_currency} → {to_currency}: {texts['no_rate']}")
+                continue
+            line = f"{from_currency} → {to_currency}: {self.conversion.format_rate(rate)}"
+            # Изменение за сутки по локальной истории
+            old_rate = self.rate_history.value_at(from_currency, to_currency, day_ago)
+            if old_rate:
+                line += f" ({(rate / old_rate - 1) * 100:+.2f}% {texts['change']})"
+            lines.append(line)
+        lines.append(texts['footer'])
+        return '\n'.join(lines)
+    
+    def _digest_loop(self):
+        """
+        Ставит в очередь подошедшие дайджесты и рассылает исходящую очередь.
+        Очередь лежит в базе - после перезапуска рассылка продолжается с места остановки
+        """
+        while True:
+            try:
+                now = time.time()
+                self.subscriptions.plan_due(now, self._render_digest)
+                self._drain_digests()
+                self.subscriptions.cleanup(now - 2 * 24 * 3600)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки дайджестов: {e}")
+            time.sleep(self.config.DIGEST_POLL_INTERVAL)
+    
+    def _drain_digests(self):
+        """
+        Рассылает исходящую очередь пачками; после каждой пачки - чекпоинт.
+        Подписки чатов, куда Telegram больше не доставляет, удаляются
+        """
+        sent = 0
+        while True:
+            batch = self.subscriptions.pending(self.config.NOTIFY_BATCH_SIZE)
+            if not batch:
+                break
+            results = self.notifier.deliver([(chat_id, text) for _, chat_id, text in batch])
+            self.subscriptions.ack([outbox_id for outbox_id, _, _ in batch])
+            sent += results.count(None)
+
+            unavailable = {chat_id for (_, chat_id, _), error in zip(batch, results) if error == CHAT_UNAVAILABLE}
+            for chat_id in unavailable:
+                removed = self.subscriptions.remove_chat(chat_id)
+                logger.info(f"Чат {chat_id} недоступен, удалено подписок: {removed}")
+        if sent:
+            logger.info(f"Разослано дайджестов: {sent}")
+    
+    def _record_history(self, api: CurrencyAPI):
+        """
+        Записывает обновленный снимок курсов в историю
+        """
+        self.rate_history.record(api.get_snapshot_prices_usd(), api.rates_updated_at)
+    
+    def _on_rates_refreshed(self, api: CurrencyAPI):
+        """
+        Вызывается после каждого обновления снимка курсов:
+        проверяет пересеченные пороги и рассылает уведомления пачками
+        """
+        triggered = self.alert_store.evaluate(api.get_snapshot_rate)
+        if not triggered:
+            return
+        
+        messages = []
+        for alert in triggered:
+            text = f"🔔 Сработало уведомление #{alert['id']}: {self._format_alert(alert)}\n"
+            text += f"📈 Курс: 1 {alert['from_currency']} = {alert['rate']:,.4f} {alert['to_currency']}"
+            messages.append((alert['chat_id'], text))
+        self.notifier.enqueue_many(messages)
+    
+    def _start_background_jobs(self):
+        """
+        Запускает фоновые задачи: рассылку и периодическое обновление курсов
+        """
+        self.notifier.start()
+        # Воркер часто проверяет общий снимок - это дешево, без запросов к API
+        interval = self.config.SNAPSHOT_POLL_INTERVAL if self.shard else self.config.RATE_REFRESH_INTERVAL
+        threading.Thread(
+            target=self.currency_api.refresh_loop, args=(interval,), name="rate-refresh", daemon=True
+        ).start()
+        threading.Thread(target=self._digest_loop, name="digests", daemon=True).start()
+    
+    def _perform_conversion(self, message: Message, amount: Decimal, from_currency: str, to_currency: str):
         """
         Выполняет конвертацию валют и отправляет результат
         """
         try:
             # Проверяем поддержку валют
-            if from_currency not in self.config.SUPPORTED_CURRENCIES:
-                currencies = ', '.join(self.config.SUPPORTED_CURRENCIES.keys())
-                error_msg = self.config.MESSAGES['unsupported_currency'].format(currencies=currencies)
-                self.bot.reply_to(message, error_msg)
-                return
-            
-            if to_currency not in self.config.SUPPORTED_CURRENCIES:
-                currencies = ', '.join(self.config.SUPPORTED_CURRENCIES.keys())
-                error_msg = self.config.MESSAGES['unsupported_currency'].format(currencies=currencies)
+            error_msg = self._unsupported_currency(from_currency, to_currency)
+            if error_msg:
                 self.bot.reply_to(message, error_msg)
                 return
             
             # Выполняем конвертацию
             logger.info(f"Конвертируем {amount} {from_currency} в {to_currency}")
             
-            # Запускаем асинхронную конвертацию
-            result = asyncio.run(self.currency_api.convert_currency(amount, from_currency, to_currency))
+            response = self._conversion_reply('conversion', amount, from_currency, to_currency)
             
-            if result:
-                converted_amount, exchange_rate = result
-                
-                # Форматируем ответ
-                from_name = self.config.SUPPORTED_CURRENCIES[from_currency]
-                to_name = self.config.SUPPORTED_CURRENCIES[to_currency]
-                
-                response = f"💱 Конвертация:\n\n"
-                response += f"📊 {amount:,.2f} {from_name}\n"
-                response += f"🔄 {converted_amount:,.2f} {to_name}\n\n"
-                response += f"📈 Курс: 1 {from_currency} = {exchange_rate:,.4f} {to_currency}"
+            if response:
+                with tracer.span('send'):
+                    self.bot.reply_to(message, response)
                 
-                self.bot.reply_to(message, response)
-                
-                logger.info(f"Успешная конвертация: {amount} {from_currency} = {converted_amount} {to_currency}")
+                logger.info(f"Успешная конвертация: {amount} {from_currency} в {to_currency}")
                 
             else:
                 self.bot.reply_to(message, self.config.MESSAGES['error'])
@@ -632,6 +1285,9 @@ class CurrencyBot:
                 logger.error("BOT_TOKEN не задан! Создайте файл .env с токеном.")
                 return
             
+            # Фоновое обновление курсов и рассылка уведомлений
+            self._start_background_jobs()
+            
             # Запускаем polling (постоянное получение сообщений)
             logger.info("Бот запущен и готов к работе!")
             self.bot.infinity_polling(timeout=10, long_polling_timeout=5)
@@ -639,12 +1295,33 @@ class CurrencyBot:
         except Exception as e:
             logger.error(f"Ошибка запуска бота: {e}")
             raise
+    
+    def run_worker(self, updates):
+        """
+        Запускает бота воркером шарда: апдейты берутся из очереди ingress-процесса
+        """
+        logger.info(f"Воркер {self.shard[0]} из {self.shard[1]} запущен")
+        self._start_background_jobs()
+        
+        while True:
+            raw_update = updates.get()
+            try:
+                self.bot.process_new_updates([Update.de_json(raw_update)])
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {raw_update.get('update_id')}: {e}")
 
 def main():
     """
     Точка входа в приложение
     """
     try:
+        config = Config()
+        if config.WORKER_PROCESSES > 1:
+            # Ingress-процесс раздает апдейты воркерам по chat_id
+            from sharding import ShardedRunner
+            ShardedRunner(config.WORKER_PROCESSES).run()
+            return
+        
         # Создаем и запускаем бота
         bot = CurrencyBot()
         bot.run()
@@ -655,5 +1332,15 @@ def main():
         logger.error(f"Критическая ошибка: {e}")
         raise
 
+def loadtest():
+    """
+    Точка входа нагрузочного теста: python bot.py loadtest --profile step --rate 200
+    """
+    from loadtest import main as loadtest_main
+    sys.exit(loadtest_main(sys.argv[2:]))
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:2] == ['loadtest']:
+        loadtest()
+    else:
+        main()
\ No newline at end of file
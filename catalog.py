@@ -0,0 +1,283 @@
+"""
+Модуль каталога валют
+Фиатные валюты и монеты берутся у провайдеров курсов и сохраняются локально в JSON.
+Поиск по коду, названию и алиасам: хэш-индекс (точное совпадение) и префиксное дерево
+"""
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+
+from config import Config
+
+# Виды валют
+FIAT = 'fiat'
+CRYPTO = 'crypto'
+
+# Код валюты: латиница и цифры (коды монет бывают вида 1INCH), не длиннее 8 символов
+_CODE_RE = re.compile(r'^[A-Z0-9]{2,8}$')
+# Начальные эмодзи и пробелы в названиях из Config: "🇺🇸 Доллар США" -> "Доллар США"
+_NAME_PREFIX_RE = re.compile(r'^[\W_]+')
+
+# Валюты из Config идут первыми, остальные - после них
+_SEED_RANK = 0
+_PROVIDER_RANK = 100
+
+def normalize(text: str) -> str:
+    """Ключ поиска: нижний регистр, ё -> е, без лишних пробелов"""
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+class CurrencyInfo:
+    """
+    Одна валюта каталога
+    """
+    __slots__ = ('code', 'name', 'kind', 'provider_id', 'rank')
+
+    def __init__(self, code: str, name: str, kind: str, provider_id: Optional[str] = None, rank: int = 0):
+        self.code = code
+        self.name = name
+        self.kind = kind
+        self.provider_id = provider_id  # id монеты в CoinGecko
+        self.rank = rank                # порядок в списках: меньше - выше
+
+    @property
+    def is_crypto(self) -> bool:
+        return self.kind == CRYPTO
+
+    def to_dict(self) -> dict:
+        return {'code': self.code, 'name': self.name, 'kind': self.kind, 'id': self.provider_id, 'rank': self.rank}
+
+class _TrieNode:
+    """
+    Узел префиксного дерева. В каждом узле заранее лежат лучшие (по рангу) коды
+    для этого префикса - подсказка за O(длина префикса), без обхода поддерева
+    """
+    __slots__ = ('children', 'codes')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.codes: List[str] = []
+
+class CurrencyCatalog:
+    """
+    Каталог валют с индексами по коду, названию и алиасам.
+    Обновление собирает новые индексы целиком и подменяет их одной операцией,
+    поэтому читать каталог можно из любых потоков без блокировок
+    """
+
+    def __init__(self, path: Optional[str] = None, suggest_limit: int = 8):
+        """
+        Args:
+            path: JSON-файл каталога (None - только валюты из Config)
+            suggest_limit: Сколько подсказок хранить в узле префиксного дерева
+        """
+        self.config = Config()
+        self.path = path
+        self.suggest_limit = suggest_limit
+        self.updated_at = 0.0
+        # Растет на каждое изменение каталога - по нему сбрасываются кэши клавиатур
+        self.version = 0
+        self._file_id: Optional[Tuple[int, int]] = None
+
+        self._currencies: Dict[str, CurrencyInfo] = {}
+        self._index: Dict[str, str] = {}
+        self._trie = _TrieNode()
+        self._by_kind: Dict[str, List[str]] = {FIAT: [], CRYPTO: []}
+
+        currencies = self._seed()
+        loaded = self._load_file()
+        if loaded:
+            for info in loaded:
+                currencies.setdefault(info.code, info)
+        self._rebuild(currencies)
+
+    def _seed(self) -> Dict[str, CurrencyInfo]:
+        """Валюты из Config: всегда есть в каталоге, их названия главнее провайдерских"""
+        currencies = {}
+        for rank, (code, name) in enumerate(self.config.SUPPORTED_CURRENCIES.items(), start=_SEED_RANK):
+            provider_id = self.config.CRYPTO_MAPPING.get(code)
+            kind = CRYPTO if provider_id else FIAT
+            currencies[code] = CurrencyInfo(code, name, kind, provider_id, rank)
+        return currencies
+
+    def _load_file(self) -> Optional[List[CurrencyInfo]]:
+        if not self.path:
+            return None
+        try:
+            stat = os.stat(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка чтения каталога валют {self.path}: {e}")
+            return None
+
+        self._file_id = (stat.st_ino, stat.st_mtime_ns)
+        self.updated_at = float(data.get('updated_at', 0))
+        return [
+            CurrencyInfo(item['code'], item['name'], item['kind'], item.get('id'), item.get('rank', _PROVIDER_RANK))
+            for item in data.get('currencies', [])
+            if _CODE_RE.match(item.get('code', ''))
+        ]
+
+    def _save_file(self):
+        """Сохраняет каталог атомарно: во временный файл и os.replace"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {
+            'updated_at': self.updated_at,
+            'currencies': [info.to_dict() for info in self._currencies.values()]
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._file_id = (stat.st_ino, stat.st_mtime_ns)
+
+    def _rebuild(self, currencies: Dict[str, CurrencyInfo]):
+        """Строит индексы заново и подменяет их"""
+        ordered = sorted(currencies.values(), key=lambda info: (info.rank, info.code))
+
+        # Сначала коды, потом названия и алиасы: код валюты важнее чужого названия
+        index: Dict[str, str] = {}
+        keys: List[Tuple[str, str]] = []
+        for info in ordered:
+            index.setdefault(normalize(info.code), info.code)
+            keys.append((normalize(info.code), info.code))
+        for info in ordered:
+            names = [_NAME_PREFIX_RE.sub('', info.name), info.provider_id or '']
+            names += self.config.CURRENCY_ALIASES.get(info.code, [])
+            for name in names:
+                key = normalize(name)
+                if key:
+                    index.setdefault(key, info.code)
+                    keys.append((key, info.code))
+
+        # Ключи уже идут по рангу - в узлы попадают лучшие коды
+        trie = _TrieNode()
+        for key, code in keys:
+            node = trie
+            for char in key:
+                node = node.children.setdefault(char, _TrieNode())
+                if len(node.codes) < self.suggest_limit and code not in node.codes:
+                    node.codes.append(code)
+
+        by_kind: Dict[str, List[str]] = {FIAT: [], CRYPTO: []}
+        for info in ordered:
+            by_kind[info.kind].append(info.code)
+
+        self._currencies, self._index, self._trie, self._by_kind = (
+            {info.code: info for info in ordered}, index, trie, by_kind
+        )
+        self.version += 1
+
+    def update(self, fiat_codes: Iterable[str], coins: List[dict], updated_at: float):
+        """
+        Обновляет каталог по данным провайдеров и сохраняет его
+
+        Args:
+            fiat_codes: Коды валют из ответа exchangerate-api
+            coins: Монеты CoinGecko /coins/markets (id, symbol, name) по убыванию капитализации
+            updated_at: Время обновления (unix)
+        """
+        currencies = self._seed()
+        for code in sorted(fiat_codes):
+            if _CODE_RE.match(code) and code not in currencies:
+                currencies[code] = CurrencyInfo(code, code, FIAT, rank=_PROVIDER_RANK)
+
+        for position, coin in enumerate(coins):
+            code = str(coin.get('symbol', '')).upper()
+            # Символы монет не уникальны - оставляем монету с большей капитализацией
+            if not _CODE_RE.match(code) or code in currencies:
+                continue
+            currencies[code] = CurrencyInfo(
+                code, coin.get('name') or code, CRYPTO, coin['id'], _PROVIDER_RANK + position
+            )
+
+        self.updated_at = updated_at
+        self._rebuild(currencies)
+        if self.path:
+            try:
+                self._save_file()
+            except OSError as e:
+                logger.error(f"Ошибка сохранения каталога валют: {e}")
+
+        logger.info(f"Каталог валют обновлен: {len(self._by_kind[FIAT])} фиат, {len(self._by_kind[CRYPTO])} крипто")
+
+    def reload_if_changed(self) -> bool:
+        """
+        Перечитывает файл, если его подменил другой процесс (режим воркера)
+
+        Returns:
+            bool: True если каталог перечитан
+        """
+        if not self.path:
+            return False
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        if (stat.st_ino, stat.st_mtime_ns) == self._file_id:
+            return False
+
+        loaded = self._load_file()
+        if loaded is None:
+            return False
+        currencies = self._seed()
+        for info in loaded:
+            currencies.setdefault(info.code, info)
+        self._rebuild(currencies)
+        return True
+
+    def is_stale(self, max_age: float, now: float) -> bool:
+        return now - self.updated_at > max_age
+
+    def get(self, code: str) -> Optional[CurrencyInfo]:
+        return self._currencies.get(code)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._currencies
+
+    def __len__(self) -> int:
+        return len(self._currencies)
+
+    def is_crypto(self, code: str) -> bool:
+        info = self._currencies.get(code)
+        return info is not None and info.kind == CRYPTO
+
+    def name(self, code: str) -> str:
+        """Название валюты для ответов; для неизвестной - сам код"""
+        info = self._currencies.get(code)
+        return info.name if info else code
+
+    def resolve(self, text: str) -> Optional[str]:
+        """
+        Код валюты по коду, названию или алиасу: "usdt", "гривна", "bitcoin"
+
+        Returns:
+            str: Код валюты или None если не нашли
+        """
+        return self._index.get(normalize(text))
+
+    def suggest(self, prefix: str) -> List[str]:
+        """
+        Подсказки по началу кода, названия или алиаса: "bt" -> ['BTC', ...]
+        """
+        node = self._trie
+        for char in normalize(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return list(node.codes)
+
+    def codes(self, kind: str) -> List[str]:
+        """Коды валют вида kind в порядке показа"""
+        return self._by_kind[kind]
+
+    def crypto_ids(self) -> Dict[str, str]:
+        """Код монеты -> id в CoinGecko"""
+        return {code: self._currencies[code].provider_id for code in self._by_kind[CRYPTO]}
@@ -0,0 +1,140 @@
+"""
+Модуль графиков курсов
+Рисует PNG без внешних библиотек (чистый Python + zlib) и кэширует готовые картинки
+"""
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# Цвета (RGB)
+BACKGROUND = b'\xff\xff\xff'
+GRID = b'\xe6\xe6\xe6'
+UP_LINE, UP_FILL = b'\x2e\x9e\x4f', b'\xe3\xf4\xe7'
+DOWN_LINE, DOWN_FILL = b'\xd9\x3f\x3f', b'\xfb\xe5\xe5'
+
+PADDING = 12
+
+def downsample_columns(points: List[Tuple[int, float]], columns: int) -> List[Tuple[float, float]]:
+    """
+    Прореживает ряд до одной колонки на пиксель: (мин, макс) значений в колонке.
+    Ряд ступенчатый, поэтому пустые колонки продолжают последнее значение
+
+    Args:
+        points: (время, значение) по возрастанию времени
+        columns: Ширина области графика в пикселях
+    """
+    start, end = points[0][0], points[-1][0]
+    span = max(end - start, 1)
+
+    lows: List[Optional[float]] = [None] * columns
+    highs: List[Optional[float]] = [None] * columns
+    last_in_column: List[Optional[float]] = [None] * columns
+
+    # Один проход по точкам: точка попадает в колонку по своему времени
+    for ts, value in points:
+        x = (ts - start) * (columns - 1) // span
+        if lows[x] is None:
+            lows[x] = highs[x] = value
+        else:
+            lows[x] = min(lows[x], value)
+            highs[x] = max(highs[x], value)
+        last_in_column[x] = value
+
+    result: List[Tuple[float, float]] = []
+    previous = points[0][1]
+    for x in range(columns):
+        if lows[x] is None:
+            result.append((previous, previous))
+            continue
+        # Соединяем с предыдущей колонкой, чтобы линия была непрерывной
+        result.append((min(lows[x], previous), max(highs[x], previous)))
+        previous = last_in_column[x]
+    return result
+
+def _encode_png(width: int, height: int, pixels: bytearray) -> bytes:
+    """Кодирует RGB-буфер в PNG"""
+    row = width * 3
+    raw = b''.join(b'\x00' + bytes(pixels[y * row:(y + 1) * row]) for y in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b'')
+
+def render_chart(points: List[Tuple[int, float]], width: int, height: int) -> bytes:
+    """
+    Рисует график ряда: линия и заливка под ней, зеленый при росте, красный при падении
+
+    Returns:
+        bytes: PNG-картинка
+    """
+    pixels = bytearray(BACKGROUND * (width * height))
+    plot_width = width - 2 * PADDING
+    plot_height = height - 2 * PADDING
+
+    def fill_row(y: int, x0: int, x1: int, color: bytes):
+        offset = (y * width + x0) * 3
+        pixels[offset:offset + (x1 - x0) * 3] = color * (x1 - x0)
+
+    # Горизонтальная сетка
+    for i in range(5):
+        fill_row(PADDING + i * (plot_height - 1) // 4, PADDING, PADDING + plot_width, GRID)
+
+    columns = downsample_columns(points, plot_width)
+    low = min(c[0] for c in columns)
+    high = max(c[1] for c in columns)
+    scale = (plot_height - 1) / (high - low) if high > low else 0.0
+
+    def to_y(value: float) -> int:
+        if not scale:
+            return PADDING + plot_height // 2
+        return PADDING + plot_height - 1 - int((value - low) * scale)
+
+    line, fill = (UP_LINE, UP_FILL) if points[-1][1] >= points[0][1] else (DOWN_LINE, DOWN_FILL)
+    bottom = PADDING + plot_height
+
+    for i, (column_low, column_high) in enumerate(columns):
+        x = PADDING + i
+        top, line_bottom = to_y(column_high), to_y(column_low)
+        for y in range(line_bottom + 1, bottom):
+            offset = (y * width + x) * 3
+            pixels[offset:offset + 3] = fill
+        # Линия толщиной 2 пикселя по вертикали
+        for y in range(max(top - 1, PADDING), line_bottom + 1):
+            offset = (y * width + x) * 3
+            pixels[offset:offset + 3] = line
+
+    return _encode_png(width, height, pixels)
+
+class ChartCache:
+    """
+    LRU-кэш готовых графиков: ключ (пара, период, эпоха снимка курсов).
+    Хранит PNG и file_id Telegram, чтобы повторно не загружать картинку
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key: tuple, png: bytes, caption: str, file_id: Optional[str] = None):
+        with self._lock:
+            self._items[key] = {'png': png, 'caption': caption, 'file_id': file_id}
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def set_file_id(self, key: tuple, file_id: str):
+        with self._lock:
+            if key in self._items:
+                self._items[key]['file_id'] = file_id
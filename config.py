@@ -3,7 +3,7 @@
 Здесь хранятся все настройки, токены и константы
 """
 import os
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from dotenv import load_dotenv
 
 # Загружаем переменные из .env файла
@@ -33,6 +33,27 @@ class Config:
         'TON': '💎 Toncoin'
     }
     
+    # Символы валют
+    CURRENCY_SYMBOLS: Dict[str, str] = {
+        'USD': '$',
+        'EUR': '€',
+        'RUB': '₽',
+        'UAH': '₴',
+        'BTC': '₿',
+        'ETH': 'Ξ',
+        'USDT': '₮',
+        'TRX': 'TRX',
+        'TON': 'TON'
+    }
+    
+    # Знаков после точки при выводе сумм: по умолчанию для фиата и крипты,
+    # и исключения (стейблкоин показываем как фиат)
+    FIAT_DECIMALS = 2
+    CRYPTO_DECIMALS = 8
+    CURRENCY_DECIMALS: Dict[str, int] = {
+        'USDT': 2
+    }
+    
     # Валюта по умолчанию для конвертации
     DEFAULT_TARGET_CURRENCY = 'RUB'
     
@@ -42,6 +63,123 @@ class Config:
     # URL для криптовалют (бесплатный API CoinGecko)
     CRYPTO_API_URL = 'https://api.coingecko.com/api/v3/simple/price'
     
+    # Админы бота (id через запятую) - им доступны служебные команды
+    ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()}
+    
+    # Контроль нагрузки: запросов в секунду и запас на пользователя,
+    # параллельная обработка и максимальная очередь на процесс
+    USER_RATE_LIMIT = float(os.getenv('USER_RATE_LIMIT', '1'))
+    USER_BURST = int(os.getenv('USER_BURST', '5'))
+    MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', '4'))
+    MAX_QUEUED_REQUESTS = int(os.getenv('MAX_QUEUED_REQUESTS', '200'))
+    
+    # Каталог для локальных данных (алерты и т.п.)
+    DATA_DIR = os.getenv('DATA_DIR', 'data')
+    
+    # Интервал фонового обновления снимка курсов (секунды)
+    RATE_REFRESH_INTERVAL = int(os.getenv('RATE_REFRESH_INTERVAL', '60'))
+    
+    # Шардирование: число процессов-воркеров (1 - все в одном процессе)
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+    # Очередь апдейтов на воркер и как часто воркер проверяет общий снимок курсов
+    SHARD_QUEUE_SIZE = 1000
+    SNAPSHOT_POLL_INTERVAL = 1.0
+    # Сколько ingress ждет места в очереди воркера (секунды), дальше апдейт отбрасывается
+    SHARD_PUT_TIMEOUT = 1.0
+    # Проверка воркеров (секунды) и сколько воркер может не разбирать полную очередь до перезапуска
+    WORKER_CHECK_INTERVAL = 5
+    WORKER_STALL_TIMEOUT = int(os.getenv('WORKER_STALL_TIMEOUT', '30'))
+    # Общий снимок курсов: пишет ingress-процесс, воркеры читают через mmap
+    RATES_SNAPSHOT_PATH = os.path.join(DATA_DIR, 'rates.snapshot')
+    
+    # Ценовые уведомления: файл базы и лимит алертов на пользователя
+    ALERTS_DB_PATH = os.path.join(DATA_DIR, 'alerts.db')
+    MAX_ALERTS_PER_USER = int(os.getenv('MAX_ALERTS_PER_USER', '20'))
+    
+    # Подписки на дайджесты курсов: файл базы, лимиты и час рассылки по умолчанию (UTC)
+    SUBSCRIPTIONS_DB_PATH = os.path.join(DATA_DIR, 'subscriptions.db')
+    MAX_SUBSCRIPTIONS_PER_USER = int(os.getenv('MAX_SUBSCRIPTIONS_PER_USER', '5'))
+    DIGEST_MAX_PAIRS = 10
+    DIGEST_DEFAULT_HOUR = 9
+    # Как часто проверять подошедшие дайджесты (секунды)
+    DIGEST_POLL_INTERVAL = 30
+    
+    # Расписания в /subscribe (слово -> расписание)
+    DIGEST_SCHEDULES: Dict[str, str] = {
+        'daily': 'daily',
+        'ежедневно': 'daily',
+        'hourly': 'hourly',
+        'ежечасно': 'hourly'
+    }
+    
+    # Тексты дайджеста по языку пользователя
+    DIGEST_TEXTS: Dict[str, Dict[str, str]] = {
+        'ru': {
+            'header': '📬 Курсы на {time} UTC:\n',
+            'change': 'за 24ч',
+            'no_rate': 'нет курса',
+            'footer': '\n🔕 Отписаться: /unsubscribe'
+        },
+        'en': {
+            'header': '📬 Rates at {time} UTC:\n',
+            'change': '24h',
+            'no_rate': 'no rate',
+            'footer': '\n🔕 Unsubscribe: /unsubscribe'
+        }
+    }
+    
+    # История курсов: сырые точки храним 2 дня, дальше по одной в час, всего 90 дней
+    HISTORY_DIR = os.path.join(DATA_DIR, 'history')
+    HISTORY_RAW_RETENTION = 2 * 24 * 3600
+    HISTORY_RETENTION = int(os.getenv('HISTORY_RETENTION_DAYS', '90')) * 24 * 3600
+    HISTORY_DOWNSAMPLE_STEP = 3600
+    
+    # Периоды для /history (суффикс -> секунды)
+    HISTORY_PERIOD_UNITS: Dict[str, int] = {
+        'h': 3600,
+        'd': 24 * 3600,
+        'w': 7 * 24 * 3600
+    }
+    
+    # Графики курсов: размер картинки и сколько готовых PNG держать в кэше
+    CHART_WIDTH = 640
+    CHART_HEIGHT = 320
+    CHART_CACHE_SIZE = 128
+    
+    # Кэш готовых ответов о конвертации (сбрасывается с каждым новым снимком курсов)
+    REPLY_CACHE_SIZE = int(os.getenv('REPLY_CACHE_SIZE', '10000'))
+    
+    # Профилирование по команде /profile: куда писать профили, шаг выборки и максимум секунд
+    PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')
+    PROFILE_INTERVAL = 0.005
+    PROFILE_MAX_SECONDS = 120
+    
+    # Трассировка апдейтов по этапам (/traces): включена ли при старте,
+    # сколько медленных трасс хранить и с какой длительности трасса медленная
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', '0') == '1'
+    TRACE_BUFFER_SIZE = 50
+    TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '100'))
+    
+    # Нагрузочный тест (python bot.py loadtest): файл с результатами базового прогона
+    LOADTEST_BASELINE_PATH = os.getenv('LOADTEST_BASELINE_PATH', 'loadtest_baseline.json')
+    # SLO: метрика -> (допустимое ухудшение относительно базы в долях, абсолютный запас).
+    # Запас нужен метрикам около нуля: доля ошибок, рост состояний и кэшей
+    LOADTEST_SLO: Dict[str, Tuple[float, float]] = {
+        'throughput_rps': (0.05, 0.0),
+        'latency_p50_ms': (0.25, 1.0),
+        'latency_p95_ms': (0.25, 2.0),
+        'latency_p99_ms': (0.35, 5.0),
+        'error_rate': (0.0, 0.001),
+        'shed_rate': (0.0, 0.01),
+        'upstream_amplification': (0.10, 0.001),
+        'user_states_growth': (0.10, 20),
+        'cache_entries_growth': (0.10, 100)
+    }
+    
+    # Пакетная рассылка: сообщений за пачку и пауза между пачками (Telegram ~30 msg/s)
+    NOTIFY_BATCH_SIZE = 25
+    NOTIFY_BATCH_INTERVAL = 1.0
+    
     # Маппинг криптовалют для API
     CRYPTO_MAPPING: Dict[str, str] = {
         'BTC': 'bitcoin',
@@ -51,6 +189,40 @@ class Config:
         'TON': 'the-open-network'
     }
     
+    # Каталог валют: все фиатные валюты exchangerate-api и топ монет CoinGecko,
+    # обновляется раз в сутки и хранится локально
+    CATALOG_PATH = os.path.join(DATA_DIR, 'catalog.json')
+    CATALOG_REFRESH_INTERVAL = 24 * 3600
+    CATALOG_CRYPTO_LIMIT = int(os.getenv('CATALOG_CRYPTO_LIMIT', '300'))
+    CRYPTO_MARKETS_URL = 'https://api.coingecko.com/api/v3/coins/markets'
+    # Фиатные валюты, в которых цены монет запрашиваются напрямую (остальные - через USD)
+    CRYPTO_VS_CURRENCIES: List[str] = ['USD', 'EUR', 'RUB', 'UAH']
+    
+    # Алиасы валют для поиска (регистр и ё не важны)
+    CURRENCY_ALIASES: Dict[str, List[str]] = {
+        'USD': ['доллар', 'доллары', 'долларов', 'бакс', 'баксы', 'баксов', 'dollar'],
+        'EUR': ['евро', 'euro'],
+        'RUB': ['рубль', 'рубли', 'рублей', 'руб', 'ruble'],
+        'UAH': ['гривна', 'гривны', 'гривен', 'грн', 'hryvnia'],
+        'GBP': ['фунт', 'фунты', 'фунтов', 'pound'],
+        'CNY': ['юань', 'юани', 'юаней', 'yuan'],
+        'JPY': ['иена', 'йена', 'иен', 'йен', 'yen'],
+        'KZT': ['тенге'],
+        'PLN': ['злотый', 'злотых', 'zloty'],
+        'TRY': ['лира', 'лиры', 'лир', 'lira'],
+        'CHF': ['франк', 'франки', 'франков', 'franc'],
+        'BTC': ['биткоин', 'биткоины', 'биткоинов', 'биток', 'битки'],
+        'ETH': ['эфир', 'эфириум', 'ether'],
+        'USDT': ['тезер', 'юсдт'],
+        'TRX': ['трон'],
+        'TON': ['тон', 'тонкоин']
+    }
+    
+    # Клавиатуры выбора валют: кнопок на странице, в ряду и сколько готовых клавиатур хранить
+    SELECTION_PAGE_SIZE = 15
+    SELECTION_ROW_WIDTH = 3
+    KEYBOARD_CACHE_SIZE = 512
+    
     # Сообщения бота
     MESSAGES = {
         'welcome': """
@@ -61,7 +233,8 @@ class Config:
 • Показывать курсы: `/rates`
 • Быстрая конвертация: просто напишите `20 USD`
 
-💰 Поддерживаемые валюты: USD, EUR, RUB, UAH, BTC, ETH, USDT, TRX, TON
+💰 Валюты: все фиатные и сотни криптовалют (USD, EUR, RUB, UAH, BTC, ETH, USDT, TON...)
+Можно писать и по-русски: `/convert 100 долларов в гривны`
 
 Попробуйте прямо сейчас! 🚀
         """,
@@ -73,7 +246,15 @@ class Config:
 /quick - Быстрая конвертация (кнопки)
 /help - Эта справка  
 /rates - Актуальные курсы валют
-/convert <сумма> <валюта> to <валюта> - Конвертация
+/convert <сумма> <валюта> to <валюта> - Конвертация (без аргументов - выбор из списка)
+/alert <валюта> <валюта> > <курс> - Уведомить о курсе
+/alerts - Мои уведомления
+/unalert <номер> - Удалить уведомление
+/subscribe <пары через запятую> daily|hourly [час] - Рассылка курсов
+/subscriptions - Мои подписки
+/unsubscribe <номер|all> - Отписаться
+/history <валюта> <валюта> <период> - История курса (24h, 7d, 30d)
+/chart <валюта> <валюта> <период> - График курса
 
 📝 Примеры:
 • `/convert 100 USD to RUB`
@@ -82,11 +263,40 @@ class Config:
 • `/convert 1000 TRX to USD`
 • `/convert 1000 UAH to EUR`
 • `50 EUR` (быстрая конвертация в рубли)
+• `/alert BTC USD > 70000`
+• `/alert USDT UAH < 40`
+• `/subscribe BTC USD, USDT UAH daily 6`
+• `/history BTC USD 7d`
+• `/chart TON UAH 30d`
 
 💡 Самый удобный способ - команда /quick!
         """,
         
+        'conversion': """💱 Конвертация:
+
+📊 {amount} {from_name}
+🔄 {converted} {to_name}
+
+📈 Курс: 1 {from_code} = {rate} {to_code}""",
+        
+        'conversion_callback': """💱 Конвертация выполнена!
+
+📊 {amount} {from_name}
+🔄 {converted} {to_name}
+
+📈 Курс: 1 {from_code} = {rate} {to_code}
+
+💡 Хотите еще конвертацию? Нажмите /quick""",
+        
         'error': '❌ Произошла ошибка. Попробуйте позже.',
+        'rate_limited': '⏳ Слишком много запросов. Подождите пару секунд.',
+        'overloaded': '🔥 Бот перегружен. Попробуйте через минуту.',
         'invalid_format': '❌ Неверный формат. Используйте: `/convert 100 USD to EUR`',
-        'unsupported_currency': '❌ Валюта не поддерживается. Доступны: {currencies}'
+        'unsupported_currency': '❌ Валюта {currency} не поддерживается.{suggestions}\n\nСписок валют: /convert',
+        'alert_format': '❌ Неверный формат. Используйте: `/alert BTC USD > 70000` или `/alert USDT UAH < 40`',
+        'history_format': '❌ Неверный формат. Используйте: `/history BTC USD 7d` (периоды: 24h, 7d, 30d)',
+        'chart_format': '❌ Неверный формат. Используйте: `/chart BTC USD 7d` (периоды: 24h, 7d, 30d)',
+        'subscribe_format': '❌ Неверный формат. Используйте: `/subscribe BTC USD, USDT UAH daily 6` (час по UTC) или `/subscribe EUR RUB hourly`',
+        'subscription_limit': '❌ Слишком много подписок (максимум {limit}). Удалите лишние через /unsubscribe',
+        'alert_limit': '❌ Слишком много уведомлений (максимум {limit}). Удалите лишние через /unalert'
     }
\ No newline at end of file
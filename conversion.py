@@ -0,0 +1,227 @@
+"""
+Модуль точной конвертации и форматирования сумм
+Арифметика в Decimal, точность и шаблоны ответов готовятся заранее по Config
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from string import Formatter
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from catalog import CurrencyCatalog
+from config import Config
+
+Number = Union[Decimal, float, int, str]
+
+def to_decimal(value: Number) -> Decimal:
+    """
+    Переводит число в Decimal без артефактов float:
+    0.1 -> Decimal('0.1'), а не 0.1000000000000000055...
+    """
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+class CurrencyFormat:
+    """
+    Параметры отображения одной валюты, посчитанные один раз
+    """
+    __slots__ = ('code', 'name', 'symbol', 'decimals', 'is_crypto', 'quantum')
+
+    def __init__(self, code: str, name: str, symbol: str, decimals: int, is_crypto: bool):
+        self.code = code
+        self.name = name
+        self.symbol = symbol
+        self.decimals = decimals
+        self.is_crypto = is_crypto
+        self.quantum = Decimal(1).scaleb(-decimals)
+
+    def format(self, value: Decimal) -> str:
+        """
+        Сумма с точностью валюты: 1,234.50 для фиата, 0.00001234 для крипты.
+        У крипты с высокой точностью лишние нули справа отбрасываются
+        """
+        rounded = value.quantize(self.quantum, ROUND_HALF_UP)
+        if not rounded and value:
+            # Ненулевая сумма меньше точности валюты - не показываем "0.00"
+            return format_significant(value).rstrip('0')
+
+        # После quantize у числа ровно decimals знаков - формат без точности
+        text = f"{rounded:,f}"
+        if self.is_crypto and self.decimals > 2:
+            text = text.rstrip('0').rstrip('.')
+        return text
+
+def format_significant(value: Decimal, digits: int = 4) -> str:
+    """
+    Число с digits значащими цифрами, но не меньше 4 знаков после точки:
+    курс 1 UAH = 0.0000004167 BTC вместо 0.0000
+    """
+    decimals = max(4, digits - 1 - value.adjusted())
+    return f"{value:,.{decimals}f}"
+
+def compile_template(template: str, fields: Tuple[str, ...]) -> Callable[..., str]:
+    """
+    Разбирает шаблон str.format один раз и возвращает функцию, которая только
+    склеивает готовые куски: "Курс: {rate}" -> ''.join(("Курс: ", rate, "")).
+    Это в разы быстрее str.format
+
+    Args:
+        fields: Имена полей шаблона - аргументы функции по порядку
+    """
+    # Раскладка: literals[0], аргумент slots[0], literals[1], ... - литералов на один больше, чем полей
+    literals = ['']
+    slots = []
+    for literal, field, _, _ in Formatter().parse(template):
+        literals[-1] += literal
+        if field:
+            if field not in fields:
+                raise KeyError(field)
+            slots.append(fields.index(field))
+            literals.append('')
+
+    # Горячий путь - ответ о конвертации: три поля по порядку, без циклов и индексации
+    if slots == [0, 1, 2]:
+        l0, l1, l2, l3 = literals
+
+        def render(first: str, second: str, third: str) -> str:
+            return f"{l0}{first}{l1}{second}{l2}{third}{l3}"
+        return render
+
+    head = literals[0]
+    layout = list(zip(slots, literals[1:]))
+
+    def render(*args: str) -> str:
+        parts = [head]
+        for index, literal in layout:
+            parts.append(args[index])
+            parts.append(literal)
+        return ''.join(parts)
+    return render
+
+class ConversionEngine:
+    """
+    Конвертация и сборка ответа.
+    Форматы валют и шаблоны ответов для пар готовятся заранее
+    """
+
+    def __init__(self, catalog: Optional[CurrencyCatalog] = None):
+        """
+        Args:
+            catalog: Каталог валют - из него берутся названия валют не из Config
+        """
+        self.config = Config()
+        self.catalog = catalog
+        self._formats: Dict[str, CurrencyFormat] = {}
+        for code, name in self.config.SUPPORTED_CURRENCIES.items():
+            self._formats[code] = self._make_format(code, name, code in self.config.CRYPTO_MAPPING)
+
+        # (шаблон, из, в) -> скомпилированный шаблон с уже подставленными названиями валют
+        self._templates: Dict[Tuple[str, str, str], Callable[[str, str, str], str]] = {}
+        # Курс float -> (Decimal, текст): курсы меняются только при обновлении снимка
+        self._rates: Dict[float, Tuple[Decimal, str]] = {}
+        # Введенные суммы повторяются (100, 50, 1000) - их текст тоже кэшируем
+        self._amounts: Dict[Tuple[str, Decimal], str] = {}
+
+    def _make_format(self, code: str, name: str, is_crypto: bool) -> CurrencyFormat:
+        default = self.config.CRYPTO_DECIMALS if is_crypto else self.config.FIAT_DECIMALS
+        return CurrencyFormat(
+            code, name,
+            symbol=self.config.CURRENCY_SYMBOLS.get(code, code),
+            decimals=self.config.CURRENCY_DECIMALS.get(code, default),
+            is_crypto=is_crypto
+        )
+
+    def get_format(self, code: str) -> CurrencyFormat:
+        """Формат валюты из каталога; для неизвестной - как у фиата"""
+        currency_format = self._formats.get(code)
+        if currency_format is None:
+            info = self.catalog.get(code) if self.catalog else None
+            if info is not None:
+                currency_format = self._make_format(code, info.name, info.is_crypto)
+            else:
+                currency_format = self._make_format(code, code, is_crypto=False)
+            self._formats[code] = currency_format
+        return currency_format
+
+    def _rate_entry(self, rate: Number) -> Tuple[Decimal, str]:
+        """Курс в Decimal и готовым текстом, с кэшем по значению курса"""
+        entry = self._rates.get(rate)
+        if entry is None:
+            if len(self._rates) >= 4096:
+                self._rates.clear()
+            value = to_decimal(rate)
+            if value and value.adjusted() < 0:
+                # Маленький курс: 4 значащие цифры вместо 0.0000
+                text = format_significant(value)
+            else:
+                text = f"{value:,.4f}"
+            entry = self._rates[rate] = (value, text)
+        return entry
+
+    def convert(self, amount: Number, rate: Number) -> Decimal:
+        """
+        Точная конвертация суммы по курсу
+        """
+        entry = self._rates.get(rate)
+        if entry is None:
+            entry = self._rate_entry(rate)
+        return to_decimal(amount) * entry[0]
+
+    def _format_input_amount(self, code: str, amount: Decimal) -> str:
+        """Текст введенной суммы с кэшем: популярные суммы форматируются один раз"""
+        key = (code, amount)
+        text = self._amounts.get(key)
+        if text is None:
+            if len(self._amounts) >= 4096:
+                self._amounts.clear()
+            text = self._amounts[key] = self.get_format(code).format(amount)
+        return text
+
+    def format_rate(self, rate: Number) -> str:
+        """Курс обмена: 4 знака, у маленьких курсов - 4 значащие цифры"""
+        return self._rate_entry(rate)[1]
+
+    def _template(self, kind: str, from_currency: str, to_currency: str) -> Callable[[str, str, str], str]:
+        """Шаблон ответа для пары: названия валют подставлены заранее"""
+        key = (kind, from_currency, to_currency)
+        template = self._templates.get(key)
+        if template is None:
+            text = self.config.MESSAGES[kind].format(
+                from_code=from_currency,
+                to_code=to_currency,
+                from_name=self.get_format(from_currency).name,
+                to_name=self.get_format(to_currency).name,
+                amount='{amount}',
+                converted='{converted}',
+                rate='{rate}'
+            )
+            template = self._templates[key] = compile_template(text, ('amount', 'converted', 'rate'))
+        return template
+
+    def render(self, kind: str, from_currency: str, to_currency: str,
+               amount: Number, converted: Number, rate: Number) -> str:
+        """
+        Собирает ответ о конвертации по шаблону из Config.MESSAGES
+
+        Args:
+            kind: Ключ шаблона ('conversion', 'conversion_callback')
+        """
+        # Горячий путь: все берется из готовых кэшей, без лишних вызовов
+        template = self._templates.get((kind, from_currency, to_currency))
+        if template is None:
+            template = self._template(kind, from_currency, to_currency)
+
+        amount = to_decimal(amount)
+        amount_text = self._amounts.get((from_currency, amount))
+        if amount_text is None:
+            amount_text = self._format_input_amount(from_currency, amount)
+
+        rate_entry = self._rates.get(rate)
+        if rate_entry is None:
+            rate_entry = self._rate_entry(rate)
+
+        to_format = self._formats.get(to_currency)
+        if to_format is None:
+            to_format = self.get_format(to_currency)
+        return template(amount_text, to_format.format(to_decimal(converted)), rate_entry[1])
@@ -4,21 +4,65 @@
 """
 import requests
 import asyncio
-from typing import Dict, Optional, Tuple
+import threading
+import time
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 from loguru import logger
+from catalog import CRYPTO, FIAT, CurrencyCatalog
 from config import Config
+from conversion import ConversionEngine, Number
+from profiling import tracer
+from rate_snapshot import RateTable, SnapshotReader, write_snapshot
 
 class CurrencyAPI:
     """
     Класс для работы с валютными API
     """
     
-    def __init__(self):
+    def __init__(self, snapshot_path: Optional[str] = None, read_only: bool = False):
+        """
+        Args:
+            snapshot_path: Файл снимка курсов: пишется на каждом обновлении,
+                а при старте курсы сразу берутся из него
+            read_only: Курсы берутся только из снимка (режим воркера), без запросов к API
+        """
         self.config = Config()
         # Кэш для курсов валют (чтобы не делать много запросов)
         self._cache: Dict[str, float] = {}
         self._cache_timeout = 300  # 5 минут
         
+        # Снимок всех курсов одним массивом: фиатная строка (единиц валюты за 1 USD)
+        # и крипто-сетка (цена монеты в каждой фиатной валюте)
+        self._rates = RateTable.empty()
+        self._rates_updated_at = 0.0
+        # Версия снимка растет на каждое обновление - по ней сбрасываются кэши ответов
+        self._snapshot_version = 0
+        self._last_refresh_failure = 0.0
+        self._refresh_retry_interval = 30  # не долбим упавший API чаще
+        self._refresh_lock = threading.Lock()
+        self._snapshot_path = snapshot_path
+        self._read_only = read_only
+        self._snapshot_reader = SnapshotReader(snapshot_path) if snapshot_path else None
+        self._sources = (urlsplit(self.config.EXCHANGE_API_URL).netloc, urlsplit(self.config.CRYPTO_API_URL).netloc)
+        
+        # Каталог валют: обновляется вместе со снимком, но не чаще раза в сутки
+        self.catalog = CurrencyCatalog(self.config.CATALOG_PATH)
+        self._last_catalog_failure = 0.0
+        # Точная конвертация с кэшем курсов в Decimal и готовые шаблоны ответов
+        self.conversion = ConversionEngine(self.catalog)
+        
+        # После перезапуска отвечаем по сохраненному снимку, не дожидаясь API
+        if self._snapshot_reader is not None:
+            table = self._snapshot_reader.load_if_changed()
+            if table is not None:
+                self._apply_rates(table)
+                logger.info(f"Загружен снимок курсов от {time.strftime('%d.%m %H:%M', time.localtime(table.updated_at))}")
+        
+        # Подписчики на обновление снимка (алерты и т.п.)
+        self._rate_listeners: List[Callable[['CurrencyAPI'], None]] = []
+        
     async def get_exchange_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
         """
         Получает курс обмена между двумя валютами
@@ -31,12 +75,12 @@ class CurrencyAPI:
             float: Курс обмена или None если ошибка
         """
         try:
-            # Проверяем, есть ли валюты в поддерживаемых
-            if from_currency not in self.config.SUPPORTED_CURRENCIES:
+            # Проверяем, есть ли валюты в каталоге
+            if from_currency not in self.catalog:
                 logger.warning(f"Неподдерживаемая валюта: {from_currency}")
                 return None
                 
-            if to_currency not in self.config.SUPPORTED_CURRENCIES:
+            if to_currency not in self.catalog:
                 logger.warning(f"Неподдерживаемая валюта: {to_currency}")
                 return None
             
@@ -44,6 +88,16 @@ class CurrencyAPI:
             if from_currency == to_currency:
                 return 1.0
             
+            # Сначала пробуем снимок курсов - без отдельного запроса на пару
+            if self.is_snapshot_fresh() or await self.refresh_rates():
+                rate = self.get_snapshot_rate(from_currency, to_currency)
+                if rate:
+                    return rate
+            
+            # Воркер не ходит в API сам - курсы получает только ingress-процесс
+            if self._read_only:
+                return self.get_snapshot_rate(from_currency, to_currency)
+            
             # Получаем курсы для криптовалют и обычных валют по-разному
             if self._is_crypto(from_currency) or self._is_crypto(to_currency):
                 return await self._get_crypto_rate(from_currency, to_currency)
@@ -56,7 +110,252 @@ class CurrencyAPI:
     
     def _is_crypto(self, currency: str) -> bool:
         """Проверяет, является ли валюта криптовалютой"""
-        return currency in self.config.CRYPTO_MAPPING
+        return self.catalog.is_crypto(currency)
+    
+    def add_rate_listener(self, listener: Callable[['CurrencyAPI'], None]):
+        """
+        Подписывает функцию на каждое обновление снимка курсов
+        """
+        self._rate_listeners.append(listener)
+    
+    def is_snapshot_fresh(self) -> bool:
+        """Проверяет, что снимок курсов не старше таймаута кэша"""
+        return time.time() - self._rates_updated_at < self._cache_timeout
+    
+    async def refresh_rates(self, force: bool = False) -> bool:
+        """
+        Обновляет снимок всех курсов за два запроса:
+        фиатную матрицу (exchangerate-api) и крипто-сетку (CoinGecko)
+        
+        Args:
+            force: Обновить даже если снимок еще свежий (фоновое обновление)
+            
+        Returns:
+            bool: True если снимок обновлен
+        """
+        with self._refresh_lock:
+            # Пока ждали блокировку, снимок мог обновить другой поток
+            if not force and self.is_snapshot_fresh():
+                return True
+            if self._read_only:
+                # Каталог пишет ingress-процесс - воркер только перечитывает файл
+                self.catalog.reload_if_changed()
+                table = self._snapshot_reader.load_if_changed()
+                if table is None:
+                    return self.is_snapshot_fresh()
+            else:
+                if time.time() - self._last_refresh_failure < self._refresh_retry_interval:
+                    return False
+                with tracer.span('fetch_all_rates'):
+                    table = self._fetch_all_rates()
+                if table is None:
+                    self._last_refresh_failure = time.time()
+                    return False
+                if self._snapshot_path:
+                    try:
+                        write_snapshot(self._snapshot_path, table)
+                    except OSError as e:
+                        logger.error(f"Ошибка сохранения снимка курсов: {e}")
+            
+            self._apply_rates(table)
+            logger.info(f"Снимок курсов обновлен: {len(table.fiat_index)} фиат, {len(table.crypto_index)} крипто")
+        
+        for listener in list(self._rate_listeners):
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error(f"Ошибка подписчика на обновление курсов: {e}")
+        
+        return True
+    
+    def refresh_loop(self, interval: float):
+        """
+        Периодически обновляет снимок курсов (цель фонового потока).
+        Подписчики на обновление вызываются из refresh_rates
+        """
+        while True:
+            try:
+                asyncio.run(self.refresh_rates(force=True))
+            except Exception as e:
+                logger.error(f"Ошибка фонового обновления курсов: {e}")
+            time.sleep(interval)
+    
+    def _apply_rates(self, table: RateTable):
+        """Подменяет снимок одной операцией - читатели видят либо старый, либо новый"""
+        self._rates = table
+        self._rates_updated_at = table.updated_at
+        self._snapshot_version += 1
+    
+    def _get_json(self, url: str, params: Optional[dict] = None):
+        """
+        GET-запрос к API и разбор JSON; запрос и разбор - отдельные этапы трассы
+        """
+        with tracer.span('http'):
+            response = requests.get(url, params=params, timeout=10)
+            response.raise_for_status()
+        with tracer.span('json'):
+            return response.json()
+    
+    def _fetch_all_rates(self) -> Optional[RateTable]:
+        """
+        Запрашивает фиатную матрицу и крипто-сетку у API
+        
+        Returns:
+            RateTable: Курсы в порядке каталога или None если ошибка
+        """
+        try:
+            fiat_codes = self.config.CRYPTO_VS_CURRENCIES
+            
+            data = self._get_json(f"{self.config.EXCHANGE_API_URL}/USD")
+            fiat_rates = {
+                code: float(rate) for code, rate in data.get('rates', {}).items()
+            }
+            fiat_as_of = float(data.get('time_last_updated') or time.time())
+            
+            if self.catalog.is_stale(self.config.CATALOG_REFRESH_INTERVAL, time.time()):
+                self._refresh_catalog(fiat_rates)
+            
+            # Цены монет кусками: id сотен монет в один URL не помещаются
+            crypto_ids = list(self.catalog.crypto_ids().items())
+            crypto_rates = {}
+            for start in range(0, len(crypto_ids), 250):
+                chunk = crypto_ids[start:start + 250]
+                params = {
+                    'ids': ','.join(crypto_id for _, crypto_id in chunk),
+                    'vs_currencies': ','.join(code.lower() for code in fiat_codes)
+                }
+                data = self._get_json(self.config.CRYPTO_API_URL, params)
+                
+                for crypto, crypto_id in chunk:
+                    prices = data.get(crypto_id, {})
+                    crypto_rates[crypto] = {
+                        fiat: float(prices[fiat.lower()]) for fiat in fiat_codes if fiat.lower() in prices
+                    }
+                
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Ошибка обновления снимка курсов: {e}")
+            return None
+        
+        now = time.time()
+        return RateTable.build(
+            fiat_rates, crypto_rates, now,
+            fiat_order=self.catalog.codes(FIAT),
+            crypto_order=self.catalog.codes(CRYPTO),
+            vs_order=fiat_codes,
+            fiat_as_of=fiat_as_of,
+            crypto_as_of=now,
+            sources=self._sources
+        )
+    
+    def _refresh_catalog(self, fiat_rates: Dict[str, float]):
+        """
+        Обновляет каталог валют: фиат из уже полученной матрицы,
+        монеты - топ по капитализации из CoinGecko.
+        Ошибка не мешает обновлению курсов - остается прежний каталог
+        """
+        if time.time() - self._last_catalog_failure < self._refresh_retry_interval * 20:
+            return
+        
+        coins: List[dict] = []
+        try:
+            limit = self.config.CATALOG_CRYPTO_LIMIT
+            for page in range(1, (limit + 249) // 250 + 1):
+                params = {
+                    'vs_currency': 'usd',
+                    'order': 'market_cap_desc',
+                    'per_page': 250,
+                    'page': page
+                }
+                data = self._get_json(self.config.CRYPTO_MARKETS_URL, params)
+                # При ошибке CoinGecko присылает объект со статусом вместо списка
+                if not isinstance(data, list):
+                    raise ValueError(f"неожиданный ответ: {str(data)[:200]}")
+                coins.extend(coin for coin in data if isinstance(coin, dict) and coin.get('id') and coin.get('symbol'))
+                if len(data) < 250:
+                    break
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Ошибка обновления каталога валют: {e}")
+            self._last_catalog_failure = time.time()
+            return
+        
+        self.catalog.update(fiat_rates, coins[:limit], time.time())
+    
+    def _snapshot_price(self, currency: str, fiat: str) -> Optional[float]:
+        """Цена 1 единицы валюты в фиатной валюте по снимку"""
+        rates = self._rates
+        if self._is_crypto(currency):
+            price = rates.crypto_price(currency, fiat)
+            if price is not None:
+                return price
+            # Фиат не запрашивали у CoinGecko - считаем через USD
+            usd_price = rates.crypto_price(currency, 'USD')
+            fiat_rate = rates.fiat_rate(fiat)
+            if usd_price is not None and fiat_rate is not None:
+                return usd_price * fiat_rate
+            return None
+        
+        currency_rate = rates.fiat_rate(currency)
+        fiat_rate = rates.fiat_rate(fiat)
+        if currency_rate and fiat_rate is not None:
+            return fiat_rate / currency_rate
+        return None
+    
+    @property
+    def rates_updated_at(self) -> float:
+        """Время последнего обновления снимка (unix), 0 если снимка нет"""
+        return self._rates_updated_at
+    
+    @property
+    def snapshot_version(self) -> int:
+        """Номер текущего снимка курсов (0 - снимка еще не было)"""
+        return self._snapshot_version
+    
+    @property
+    def rates(self) -> RateTable:
+        """Текущий снимок курсов: время курсов у провайдеров, источники"""
+        return self._rates
+    
+    def get_snapshot_prices_usd(self) -> Dict[str, float]:
+        """
+        Цены всех валют снимка в USD: строка фиатной матрицы и USD-столбец крипто-сетки
+        """
+        rates = self._rates
+        prices = {}
+        for code in rates.fiat_index:
+            rate = rates.fiat_rate(code)
+            if rate > 0:
+                prices[code] = 1.0 / rate
+        for crypto in rates.crypto_index:
+            price = self._snapshot_price(crypto, 'USD')
+            if price:
+                prices[crypto] = price
+        return prices
+    
+    def get_snapshot_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """
+        Курс обмена по текущему снимку, без запросов к API
+        
+        Returns:
+            float: Курс обмена или None если в снимке нет данных
+        """
+        if from_currency == to_currency:
+            return 1.0
+        
+        if not self._is_crypto(to_currency):
+            return self._snapshot_price(from_currency, to_currency)
+        
+        # Целевая валюта - криптовалюта: берем обратный курс
+        if not self._is_crypto(from_currency):
+            price = self._snapshot_price(to_currency, from_currency)
+        else:
+            # Крипто -> крипто через USD
+            from_usd = self._snapshot_price(from_currency, 'USD')
+            to_usd = self._snapshot_price(to_currency, 'USD')
+            price = to_usd / from_usd if from_usd and to_usd else None
+        
+        if price and price > 0:
+            return 1.0 / price
+        return None
     
     async def _get_fiat_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
         """
@@ -67,10 +366,7 @@ class CurrencyAPI:
             url = f"{self.config.EXCHANGE_API_URL}/{from_currency}"
             
             # Делаем HTTP запрос
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._get_json(url)
             
             # Извлекаем курс для нужной валюты
             if to_currency in data.get('rates', {}):
@@ -118,7 +414,8 @@ class CurrencyAPI:
     async def _get_crypto_to_fiat_rate(self, crypto: str, fiat: str) -> Optional[float]:
         """Получает курс криптовалюты к обычной валюте"""
         try:
-            crypto_id = self.config.CRYPTO_MAPPING.get(crypto)
+            info = self.catalog.get(crypto)
+            crypto_id = info.provider_id if info else None
             if not crypto_id:
                 return None
             
@@ -129,10 +426,7 @@ class CurrencyAPI:
                 'vs_currencies': fiat.lower()
             }
             
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._get_json(url, params)
             
             if crypto_id in data and fiat.lower() in data[crypto_id]:
                 rate = data[crypto_id][fiat.lower()]
@@ -153,7 +447,7 @@ class CurrencyAPI:
             return 1.0 / crypto_to_fiat
         return None
     
-    async def convert_currency(self, amount: float, from_currency: str, to_currency: str) -> Optional[Tuple[float, float]]:
+    async def convert_currency(self, amount: Number, from_currency: str, to_currency: str) -> Optional[Tuple[Decimal, float]]:
         """
         Конвертирует сумму из одной валюты в другую
         
@@ -163,11 +457,13 @@ class CurrencyAPI:
             to_currency: Целевая валюта
             
         Returns:
-            Tuple[float, float]: (конвертированная_сумма, курс_обмена) или None
+            Tuple[Decimal, float]: (конвертированная_сумма, курс_обмена) или None
         """
-        rate = await self.get_exchange_rate(from_currency, to_currency)
+        with tracer.span('rate_lookup'):
+            rate = await self.get_exchange_rate(from_currency, to_currency)
         if rate is not None:
-            converted_amount = amount * rate
+            # Считаем в Decimal, чтобы не терять копейки и сатоши на float
+            converted_amount = self.conversion.convert(amount, rate)
             return converted_amount, rate
         return None
     
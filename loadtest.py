@@ -0,0 +1,750 @@
+"""
+Модуль нагрузочного тестирования
+Гоняет обработчики CurrencyBot синтетическими Message и CallbackQuery с заданной частотой,
+курсы отдает подменный источник. Результат сравнивается с сохраненной базой:
+ухудшение SLO - ненулевой код выхода, регрессия ловится до выкладки.
+Запуск: python bot.py loadtest --profile step --rate 200 --duration 60
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from loguru import logger
+from telebot.apihelper import ApiTelegramException
+from telebot.types import Update
+
+from config import Config
+
+RAMP = 'ramp'
+STEP = 'step'
+SOAK = 'soak'
+PROFILES = (RAMP, STEP, SOAK)
+
+# Сценарий -> вес в смеси запросов
+DEFAULT_MIX: Dict[str, int] = {
+    'convert': 40,    # /convert 100 USDT to UAH
+    'natural': 10,    # /convert 100 долларов в гривны
+    'quick': 15,      # 100 USD
+    'selection': 10,  # /convert без аргументов, листание выбора валют и кнопка "назад"
+    'template': 15,   # кнопка пары, затем ввод суммы
+    'abandoned': 5,   # кнопка пары без ввода суммы - состояние остается в _user_states
+    'rates': 5        # /rates
+}
+
+# Популярные суммы: на них работает кэш ответов, остальные - случайные
+POPULAR_AMOUNTS = ['1', '10', '50', '100', '500', '1000', '0.1', '0.5']
+
+# Курсы подменного источника: единиц валюты за 1 USD и цена монет в USD
+_FIAT_PER_USD: Dict[str, float] = {
+    'USD': 1.0, 'EUR': 0.92, 'RUB': 92.5, 'UAH': 41.3, 'GBP': 0.79, 'CNY': 7.24, 'JPY': 151.0,
+    'KZT': 447.0, 'PLN': 3.98, 'TRY': 32.2, 'CHF': 0.9, 'CAD': 1.36, 'AUD': 1.52, 'INR': 83.3,
+    'BRL': 5.1, 'GEL': 2.7, 'AMD': 387.0, 'BYN': 3.27
+}
+_COIN_USD: Dict[str, float] = {
+    'bitcoin': 67000.0, 'ethereum': 3500.0, 'tether': 1.0, 'tron': 0.12, 'the-open-network': 5.2
+}
+
+# Метрики, у которых меньше - хуже (у остальных хуже - больше)
+_HIGHER_IS_BETTER = {'throughput_rps'}
+
+# Параметры прогона, которые должны совпадать с базой
+_COMPARABLE_PARAMS = ('profile', 'rate', 'duration', 'steps', 'users', 'mix', 'upstream_latency',
+                      'upstream_errors', 'volatility', 'telegram_latency', 'refresh_interval')
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль уже отсортированного списка"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def target_rate(profile: str, rate: float, duration: float, steps: int, t: float) -> float:
+    """
+    Целевая частота запросов в момент t:
+    ramp - линейно до rate, step - ступенями по rate/steps, soak - все время rate
+    """
+    if profile == RAMP:
+        return rate * max(t / duration, 0.02)
+    if profile == STEP:
+        step = min(int(t / duration * steps), steps - 1)
+        return rate * (step + 1) / steps
+    return rate
+
+def _rss_kb() -> int:
+    """Резидентная память процесса (КБ)"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class MockRateSource:
+    """
+    Подменный источник курсов: отвечает на те же URL, что exchangerate-api и CoinGecko,
+    с заданной задержкой и долей ошибок и считает запросы по эндпоинтам
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, volatility: float = 0.0,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            latency: Задержка каждого ответа (секунды)
+            error_rate: Доля запросов, которые падают с ошибкой соединения
+            volatility: Разброс курсов между ответами (доля) - снимки отличаются друг от друга
+        """
+        self.config = Config()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.volatility = volatility
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+        self._fiat = dict(_FIAT_PER_USD)
+        # Монеты по убыванию капитализации: сначала из Config, до лимита каталога - синтетические
+        self._coins: List[Tuple[str, str, str, float]] = [
+            (crypto_id, code, self.config.SUPPORTED_CURRENCIES.get(code, code), _COIN_USD.get(crypto_id, 1.0))
+            for code, crypto_id in self.config.CRYPTO_MAPPING.items()
+        ]
+        for i in range(self.config.CATALOG_CRYPTO_LIMIT - len(self._coins)):
+            self._coins.append((f"loadcoin-{i}", f"LC{i}", f"Load Coin {i}", 10.0 / (i + 1)))
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+
+    def get_json(self, url: str, params: Optional[dict] = None):
+        """Замена CurrencyAPI._get_json"""
+        if url.startswith(self.config.EXCHANGE_API_URL):
+            endpoint = 'exchangerate'
+        elif url.startswith(self.config.CRYPTO_MARKETS_URL):
+            endpoint = 'coingecko_markets'
+        elif url.startswith(self.config.CRYPTO_API_URL):
+            endpoint = 'coingecko_price'
+        else:
+            raise requests.HTTPError(f"неизвестный URL {url}")
+
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise requests.ConnectionError(f"{endpoint}: искусственная ошибка")
+
+        with self._lock:
+            if endpoint == 'exchangerate':
+                return self._fiat_response(url.rsplit('/', 1)[1])
+            if endpoint == 'coingecko_markets':
+                return self._markets_response(params or {})
+            return self._prices_response(params or {})
+
+    def _drift(self, value: float) -> float:
+        return value * (1 + self._random.gauss(0, self.volatility)) if self.volatility else value
+
+    def _fiat_response(self, base: str) -> dict:
+        if base not in self._fiat:
+            raise requests.HTTPError(f"404: {base}")
+        self._fiat = {code: rate if code == 'USD' else self._drift(rate) for code, rate in self._fiat.items()}
+        base_rate = self._fiat[base]
+        return {
+            'base': base,
+            'rates': {code: rate / base_rate for code, rate in self._fiat.items()},
+            'time_last_updated': int(time.time())
+        }
+
+    def _markets_response(self, params: dict) -> List[dict]:
+        per_page = int(params.get('per_page', 100))
+        start = (int(params.get('page', 1)) - 1) * per_page
+        return [
+            {'id': crypto_id, 'symbol': code.lower(), 'name': name, 'current_price': price}
+            for crypto_id, code, name, price in self._coins[start:start + per_page]
+        ]
+
+    def _prices_response(self, params: dict) -> dict:
+        ids = set(params.get('ids', '').split(','))
+        vs_codes = [vs for vs in params.get('vs_currencies', '').split(',') if vs.upper() in self._fiat]
+        self._coins = [(crypto_id, code, name, self._drift(price)) for crypto_id, code, name, price in self._coins]
+        return {
+            crypto_id: {vs: price * self._fiat[vs.upper()] for vs in vs_codes}
+            for crypto_id, _, _, price in self._coins
+            if crypto_id in ids
+        }
+
+    def fiat_codes(self) -> List[str]:
+        return list(self._fiat)
+
+class LoadTest:
+    """
+    Открытая модель нагрузки: запросы идут с целевой частотой независимо от того,
+    успевает ли бот, - так видно и очередь, и отказы при перегрузке
+    """
+
+    def __init__(self, profile: str, rate: float, duration: float, steps: int = 4, users: int = 2000,
+                 mix: Optional[Dict[str, int]] = None, source: Optional[MockRateSource] = None,
+                 telegram_latency: float = 0.0, drain: float = 10.0, seed: Optional[int] = None):
+        """
+        Args:
+            profile: ramp, step или soak
+            rate: Целевая частота (запросов в секунду); для ramp и step - максимальная
+            duration: Длительность прогона (секунды)
+            steps: Число ступеней профиля step
+            users: Сколько разных пользователей шлют запросы
+            mix: Сценарий -> вес в смеси запросов
+            telegram_latency: Задержка каждого вызова Telegram API (секунды)
+            drain: Сколько ждать обработки оставшихся запросов после окончания (секунды)
+        """
+        self.profile = profile
+        self.rate = rate
+        self.duration = duration
+        self.steps = steps
+        self.users = users
+        self.mix = mix or dict(DEFAULT_MIX)
+        self.source = source or MockRateSource(seed=seed)
+        self.telegram_latency = telegram_latency
+        self.drain = drain
+        self._random = random.Random(seed)
+
+        # Базы, снимки и каталог бота - во временном каталоге: рабочие данные не трогаем
+        self.data_dir = tempfile.mkdtemp(prefix='loadtest-')
+        self._isolate_data_dir()
+
+        # Лог обработчиков пишется как в работе, но в файл прогона, а не в консоль
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+
+        # Импорт здесь: пути в Config уже подменены
+        from bot import CurrencyBot
+        self.bot = CurrencyBot()
+        self.bot.currency_api._get_json = self.source.get_json
+        self._stub_telegram()
+        self.bot._traced = self._wrap_traced(self.bot._traced)
+        self.bot._shed = self._wrap_shed(self.bot._shed)
+
+        # CurrencyBot добавил bot.log рабочего каталога - переносим лог в каталог прогона
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        logger.add(os.path.join(self.data_dir, "bot.log"), level="INFO")
+
+        self._lock = threading.Lock()
+        self._update_id = 0
+        self._sent_at: List[float] = []                      # смещение отправки каждого запроса
+        self._done: List[Tuple[float, float, str]] = []      # (смещение отправки, задержка, сценарий)
+        self._shed_at: List[float] = []
+        self._errors = 0
+        self._telegram_calls = 0
+        # Последнее сообщение пользователя в чате: Telegram не дает боту его редактировать
+        self._user_messages: Dict[int, int] = {}
+        self._samples: List[dict] = []
+        self._started = 0.0
+        self._max_lag = 0.0
+
+        self._aliases = {
+            code: aliases for code, aliases in self.config.CURRENCY_ALIASES.items()
+            if code in self.bot.catalog or code in self.source.fiat_codes()
+        }
+        self._codes = list(self.config.SUPPORTED_CURRENCIES)
+        self._error_text = self.config.MESSAGES['error']
+
+    @property
+    def config(self) -> Config:
+        return self.bot.config
+
+    def _isolate_data_dir(self):
+        """Переносит в self.data_dir все пути Config внутри DATA_DIR"""
+        data_dir = Config.DATA_DIR
+        prefix = os.path.join(data_dir, '')
+        for name, value in list(vars(Config).items()):
+            if isinstance(value, str) and (value == data_dir or value.startswith(prefix)):
+                setattr(Config, name, self.data_dir + value[len(data_dir):])
+
+    def close(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    # --- Подмена Telegram и учет обработки ---
+
+    def _stub_telegram(self):
+        """
+        Вызовы Telegram API не уходят в сеть: считаются и (по желанию) ждут telegram_latency.
+        Правка чужого сообщения падает, как в Telegram, и считается ошибкой
+        """
+        def call(name: str):
+            def stub(*args, **kwargs):
+                with self._lock:
+                    self._telegram_calls += 1
+                    # reply_to(сообщение, текст): ответ с ошибкой конвертации считаем ошибкой
+                    if name == 'reply_to' and len(args) > 1 and args[1] == self._error_text:
+                        self._errors += 1
+                    if (name == 'edit_message_text'
+                            and self._user_messages.get(kwargs.get('chat_id')) == kwargs.get('message_id')):
+                        self._errors += 1
+                        raise ApiTelegramException(name, None, {
+                            'error_code': 400, 'description': "Bad Request: message can't be edited"
+                        })
+                if self.telegram_latency:
+                    time.sleep(self.telegram_latency)
+                return None
+            return stub
+
+        for name in ('reply_to', 'send_message', 'edit_message_text', 'answer_callback_query',
+                     'send_photo', 'send_document'):
+            setattr(self.bot.bot, name, call(name))
+
+    def _wrap_traced(self, traced):
+        def wrapper(handler, update, submitted: float):
+            try:
+                traced(handler, update, submitted)
+            except ApiTelegramException:
+                # Уже посчитано в заглушке Telegram
+                raise
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                raise
+            finally:
+                sent_at, scenario = getattr(update, '_loadtest', (None, None))
+                if sent_at is not None:
+                    with self._lock:
+                        self._done.append((sent_at - self._started, time.perf_counter() - sent_at, scenario))
+        return wrapper
+
+    def _wrap_shed(self, shed):
+        def wrapper(update, reason: str):
+            sent_at, _ = getattr(update, '_loadtest', (None, None))
+            if sent_at is not None:
+                with self._lock:
+                    self._shed_at.append(sent_at - self._started)
+            shed(update, reason)
+        return wrapper
+
+    # --- Синтетические апдейты ---
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"load{user_id}", 'language_code': 'ru'}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        self._update_id += 1
+        self._user_messages[user_id] = self._update_id
+        return {
+            'update_id': self._update_id,
+            'message': {
+                'message_id': self._update_id, 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id), 'text': text
+            }
+        }
+
+    def _callback(self, user_id: int, data: str) -> dict:
+        self._update_id += 1
+        return {
+            'update_id': self._update_id,
+            'callback_query': {
+                'id': str(self._update_id), 'from': self._user(user_id), 'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': self._update_id, 'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'}, 'text': '💱'
+                }
+            }
+        }
+
+    def _amount(self) -> str:
+        if self._random.random() < 0.7:
+            return self._random.choice(POPULAR_AMOUNTS)
+        return f"{self._random.uniform(1, 10000):.2f}"
+
+    def _pair(self) -> Tuple[str, str]:
+        from_currency, to_currency = self._random.sample(self._codes, 2)
+        return from_currency, to_currency
+
+    def _next_request(self) -> Tuple[str, dict, Optional[dict]]:
+        """
+        Returns:
+            Tuple: (сценарий, апдейт, следующий апдейт того же пользователя или None)
+        """
+        scenario = self._random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        user_id = 1_000_000 + self._random.randrange(self.users)
+        from_currency, to_currency = self._pair()
+
+        if scenario == 'convert':
+            return scenario, self._message(user_id, f"/convert {self._amount()} {from_currency} to {to_currency}"), None
+        if scenario == 'natural':
+            from_code, to_code = self._random.sample(list(self._aliases), 2)
+            text = f"/convert {self._amount()} {self._random.choice(self._aliases[from_code])} в " \
+                   f"{self._random.choice(self._aliases[to_code])}"
+            return scenario, self._message(user_id, text), None
+        if scenario == 'quick':
+            return scenario, self._message(user_id, f"{self._amount()} {from_currency}"), None
+        if scenario == 'selection':
+            choice = self._random.random()
+            if choice < 0.2:
+                return scenario, self._message(user_id, '/convert'), None
+            if choice < 0.3:
+                return scenario, self._callback(user_id, 'back_to_currencies'), None
+            kind = self._random.choice(['fiat', 'crypto'])
+            data = f"sel_{kind}_{self._random.randrange(3)}"
+            if self._random.random() < 0.5:
+                data += f"_{from_currency}"
+            return scenario, self._callback(user_id, data), None
+        if scenario in ('template', 'abandoned'):
+            update = self._callback(user_id, f"template_{from_currency.lower()}_{to_currency.lower()}")
+            followup = self._message(user_id, self._amount()) if scenario == 'template' else None
+            return scenario, update, followup
+        return scenario, self._message(user_id, '/rates'), None
+
+    def _send(self, scenario: str, raw: dict):
+        update = Update.de_json(raw)
+        target = update.message or update.callback_query
+        sent_at = time.perf_counter()
+        target._loadtest = (sent_at, scenario)
+        with self._lock:
+            self._sent_at.append(sent_at - self._started)
+        self.bot.bot.process_new_updates([update])
+
+    # --- Прогон ---
+
+    def _sample(self) -> dict:
+        bot = self.bot
+        conversion = bot.conversion
+        with self._lock:
+            sent, completed, shed = len(self._sent_at), len(self._done), len(self._shed_at)
+        return {
+            't': round(time.perf_counter() - self._started, 2),
+            'sent': sent,
+            'completed': completed,
+            'shed': shed,
+            'queue_depth': bot.admission.stats()['queue_depth'],
+            'user_states': len(getattr(bot, '_user_states', {})),
+            'reply_cache': bot.reply_cache.stats()['size'],
+            'keyboard_cache': bot.keyboard_cache.stats()['size'],
+            'conversion_caches': len(conversion._rates) + len(conversion._amounts)
+                                 + len(conversion._templates) + len(conversion._formats),
+            'admission_users': bot.admission.stats()['tracked_users'],
+            'rss_kb': _rss_kb()
+        }
+
+    def _sampler(self, stop: threading.Event):
+        while not stop.wait(1.0):
+            self._samples.append(self._sample())
+
+    def run(self) -> dict:
+        """
+        Прогоняет профиль нагрузки
+
+        Returns:
+            dict: Параметры прогона, метрики, фазы профиля и память по секундам
+        """
+        # Прогрев: фоновые задачи как в работе и первый снимок курсов
+        self.bot._start_background_jobs()
+        deadline = time.monotonic() + 30
+        while self.bot.currency_api.snapshot_version == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.source.reset()
+        cache_before = self.bot.reply_cache.stats()
+
+        self._started = time.perf_counter()
+        self._samples.append(self._sample())
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sampler, args=(stop,), name="loadtest-sampler", daemon=True)
+        sampler.start()
+
+        # Ввод суммы после кнопки пары приходит позже - как у живого пользователя
+        followups: List[Tuple[float, int, dict]] = []
+        next_at = self._started
+        while True:
+            now = time.perf_counter()
+            t = now - self._started
+            if t >= self.duration:
+                break
+            if now < next_at:
+                time.sleep(min(next_at - now, 0.005))
+                continue
+
+            self._max_lag = max(self._max_lag, now - next_at)
+            if followups and followups[0][0] <= now:
+                # Подошедший ввод суммы занимает очередной слот - частота остается целевой
+                _, _, raw = heapq.heappop(followups)
+                self._send('template', raw)
+            else:
+                scenario, raw, followup = self._next_request()
+                self._send(scenario, raw)
+                if followup is not None:
+                    heapq.heappush(followups, (now + self._random.uniform(0.3, 1.5), followup['update_id'], followup))
+            next_at += 1.0 / target_rate(self.profile, self.rate, self.duration, self.steps, t)
+
+        # Ждем обработки того, что уже отправлено
+        deadline = time.perf_counter() + self.drain
+        while time.perf_counter() < deadline:
+            with self._lock:
+                if len(self._done) + len(self._shed_at) >= len(self._sent_at):
+                    break
+            time.sleep(0.05)
+        stop.set()
+        sampler.join()
+        self._samples.append(self._sample())
+
+        return self._result(cache_before)
+
+    def _phases(self) -> List[Tuple[float, float]]:
+        count = {STEP: self.steps, RAMP: 4}.get(self.profile, 1)
+        return [(self.duration * i / count, self.duration * (i + 1) / count) for i in range(count)]
+
+    def _result(self, cache_before: Dict[str, int]) -> dict:
+        with self._lock:
+            sent_at = list(self._sent_at)
+            done = list(self._done)
+            shed_at = list(self._shed_at)
+            errors = self._errors
+            telegram_calls = self._telegram_calls
+
+        latencies = sorted(latency for _, latency, _ in done)
+        sent, completed, shed = len(sent_at), len(done), len(shed_at)
+        incomplete = max(0, sent - completed - shed)
+        upstream_calls = sum(self.source.calls.values())
+        cache = self.bot.reply_cache.stats()
+        lookups = (cache['hits'] - cache_before['hits']) + (cache['misses'] - cache_before['misses'])
+        first, last = self._samples[0], self._samples[-1]
+
+        def growth(key: str) -> int:
+            return last[key] - first[key]
+
+        metrics = {
+            'requests': sent,
+            'completed': completed,
+            'shed': shed,
+            'errors': errors,
+            'incomplete': incomplete,
+            'throughput_rps': completed / self.duration,
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p90_ms': percentile(latencies, 90) * 1000,
+            'latency_p95_ms': percentile(latencies, 95) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000,
+            'latency_max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            'error_rate': (errors + incomplete) / sent if sent else 0.0,
+            'shed_rate': shed / sent if sent else 0.0,
+            'upstream_calls': upstream_calls,
+            'upstream_amplification': upstream_calls / completed if completed else 0.0,
+            'telegram_calls_per_request': telegram_calls / completed if completed else 0.0,
+            'reply_cache_hit_rate': (cache['hits'] - cache_before['hits']) / lookups if lookups else 0.0,
+            'user_states_growth': growth('user_states'),
+            'cache_entries_growth': growth('reply_cache') + growth('keyboard_cache') + growth('conversion_caches'),
+            'admission_users_growth': growth('admission_users'),
+            'rss_growth_kb': growth('rss_kb'),
+            'generator_lag_max_ms': self._max_lag * 1000
+        }
+
+        phases = []
+        for start, end in self._phases():
+            phase_latencies = sorted(latency for offset, latency, _ in done if start <= offset < end)
+            length = end - start
+            phases.append({
+                'start': start,
+                'end': end,
+                'target_rps': target_rate(self.profile, self.rate, self.duration, self.steps, (start + end) / 2),
+                'sent_rps': sum(1 for offset in sent_at if start <= offset < end) / length,
+                'completed_rps': len(phase_latencies) / length,
+                'shed': sum(1 for offset in shed_at if start <= offset < end),
+                'latency_p50_ms': percentile(phase_latencies, 50) * 1000,
+                'latency_p99_ms': percentile(phase_latencies, 99) * 1000
+            })
+
+        scenarios = {}
+        for scenario in self.mix:
+            scenario_latencies = sorted(latency for _, latency, name in done if name == scenario)
+            scenarios[scenario] = {
+                'completed': len(scenario_latencies),
+                'latency_p50_ms': percentile(scenario_latencies, 50) * 1000,
+                'latency_p99_ms': percentile(scenario_latencies, 99) * 1000
+            }
+
+        return {
+            'params': {
+                'profile': self.profile,
+                'rate': self.rate,
+                'duration': self.duration,
+                'steps': self.steps,
+                'users': self.users,
+                'mix': self.mix,
+                'upstream_latency': self.source.latency,
+                'upstream_errors': self.source.error_rate,
+                'volatility': self.source.volatility,
+                'telegram_latency': self.telegram_latency,
+                'refresh_interval': self.config.RATE_REFRESH_INTERVAL
+            },
+            'metrics': metrics,
+            'upstream_by_endpoint': dict(self.source.calls),
+            'phases': phases,
+            'scenarios': scenarios,
+            'memory': {'start': first, 'end': last, 'samples': self._samples},
+            'created_at': time.time()
+        }
+
+# --- Отчет и сравнение с базой ---
+
+def format_report(result: dict) -> str:
+    params, metrics = result['params'], result['metrics']
+    lines = [
+        f"Нагрузочный тест: {params['profile']}, до {params['rate']:g} rps, {params['duration']:g} с, "
+        f"{params['users']} пользователей",
+        "",
+        f"{'Фаза':<12}{'цель rps':>10}{'отпр/с':>10}{'обраб/с':>10}{'p50 мс':>10}{'p99 мс':>10}{'отказы':>9}"
+    ]
+    for phase in result['phases']:
+        lines.append(
+            f"{phase['start']:>5.0f}-{phase['end']:<6.0f}{phase['target_rps']:>10.1f}{phase['sent_rps']:>10.1f}"
+            f"{phase['completed_rps']:>10.1f}{phase['latency_p50_ms']:>10.1f}{phase['latency_p99_ms']:>10.1f}"
+            f"{phase['shed']:>9}"
+        )
+    lines += [
+        "",
+        f"Запросов {metrics['requests']}, обработано {metrics['completed']} ({metrics['throughput_rps']:.1f}/с), "
+        f"отброшено {metrics['shed']}, ошибок {metrics['errors']}, не дождались {metrics['incomplete']}",
+        f"Задержка, мс: p50 {metrics['latency_p50_ms']:.1f}, p90 {metrics['latency_p90_ms']:.1f}, "
+        f"p95 {metrics['latency_p95_ms']:.1f}, p99 {metrics['latency_p99_ms']:.1f}, max {metrics['latency_max_ms']:.1f}",
+        f"Запросы к API курсов: {metrics['upstream_calls']} ({metrics['upstream_amplification']:.4f} на запрос) "
+        f"{result['upstream_by_endpoint']}",
+        f"Вызовов Telegram на запрос: {metrics['telegram_calls_per_request']:.2f}, "
+        f"попаданий в кэш ответов: {metrics['reply_cache_hit_rate'] * 100:.0f}%",
+        f"Рост памяти: _user_states {metrics['user_states_growth']:+d}, записи кэшей {metrics['cache_entries_growth']:+d}, "
+        f"лимитер {metrics['admission_users_growth']:+d}, RSS {metrics['rss_growth_kb'] / 1024:+.1f} МБ",
+        f"Отставание генератора: до {metrics['generator_lag_max_ms']:.1f} мс",
+        "",
+        "Сценарии:"
+    ]
+    for scenario, stats in result['scenarios'].items():
+        lines.append(
+            f"  {scenario:<10} {stats['completed']:>7}  p50 {stats['latency_p50_ms']:.1f} мс, "
+            f"p99 {stats['latency_p99_ms']:.1f} мс"
+        )
+    return '\n'.join(lines)
+
+def params_mismatch(result: dict, baseline: dict) -> List[str]:
+    """Параметры прогона, которыми он отличается от базы - такие результаты не сравнимы"""
+    return [
+        name for name in _COMPARABLE_PARAMS
+        if result['params'].get(name) != baseline.get('params', {}).get(name)
+    ]
+
+def compare(result: dict, baseline: dict, slo: Dict[str, Tuple[float, float]]) -> List[Tuple[str, float, float, float, bool]]:
+    """
+    Сравнивает метрики с базой
+
+    Args:
+        slo: Метрика -> (допустимое ухудшение в долях, абсолютный запас)
+
+    Returns:
+        List: (метрика, база, сейчас, порог, в норме)
+    """
+    rows = []
+    for metric, (tolerance, slack) in slo.items():
+        if metric not in result['metrics'] or metric not in baseline.get('metrics', {}):
+            continue
+        base = baseline['metrics'][metric]
+        current = result['metrics'][metric]
+        if metric in _HIGHER_IS_BETTER:
+            limit = base * (1 - tolerance) - slack
+            ok = current >= limit
+        else:
+            limit = base * (1 + tolerance) + slack
+            ok = current <= limit
+        rows.append((metric, base, current, limit, ok))
+    return rows
+
+def format_comparison(rows: List[Tuple[str, float, float, float, bool]], path: str) -> str:
+    lines = [f"SLO относительно базы ({path}):"]
+    for metric, base, current, limit, ok in rows:
+        lines.append(
+            f"  {metric:<26}{base:>12.4g} -> {current:<12.4g}(порог {limit:.4g})  {'OK' if ok else 'РЕГРЕССИЯ'}"
+        )
+    return '\n'.join(lines)
+
+def _parse_mix(text: str) -> Dict[str, int]:
+    """'convert=50,quick=50' -> {'convert': 50, 'quick': 50}"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name}: {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Returns:
+        int: 0 - SLO в норме (или база сохранена), 1 - регрессия,
+            2 - прогон не сравним с базой или базы нет (гейт не пропускает прогон без проверки)
+    """
+    config = Config()
+    parser = argparse.ArgumentParser(prog='python bot.py loadtest',
+                                     description='Нагрузочный тест обработчиков бота с проверкой SLO')
+    parser.add_argument('--profile', choices=PROFILES, default=STEP)
+    parser.add_argument('--rate', type=float, default=200, help='целевая (максимальная) частота, запросов в секунду')
+    parser.add_argument('--duration', type=float, default=60, help='длительность, секунды')
+    parser.add_argument('--steps', type=int, default=4, help='число ступеней профиля step')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--mix', type=_parse_mix, default=dict(DEFAULT_MIX),
+                        help=f"смесь сценариев, например convert=50,quick=50 ({', '.join(DEFAULT_MIX)})")
+    parser.add_argument('--upstream-latency', type=float, default=0.05, help='задержка API курсов, секунды')
+    parser.add_argument('--upstream-errors', type=float, default=0.0, help='доля ошибок API курсов')
+    parser.add_argument('--volatility', type=float, default=0.001, help='разброс курсов между ответами API')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='задержка вызовов Telegram, секунды')
+    parser.add_argument('--refresh-interval', type=int, default=config.RATE_REFRESH_INTERVAL,
+                        help='период фонового обновления курсов, секунды')
+    parser.add_argument('--drain', type=float, default=10, help='сколько ждать обработки после окончания')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=config.LOADTEST_BASELINE_PATH, help='файл базы')
+    parser.add_argument('--save-baseline', action='store_true', help='сохранить результат как новую базу')
+    parser.add_argument('--output', help='сохранить результат в JSON')
+    args = parser.parse_args(argv)
+
+    Config.RATE_REFRESH_INTERVAL = args.refresh_interval
+    source = MockRateSource(args.upstream_latency, args.upstream_errors, args.volatility, seed=args.seed)
+    test = LoadTest(
+        args.profile, args.rate, args.duration, steps=args.steps, users=args.users, mix=args.mix,
+        source=source, telegram_latency=args.telegram_latency, drain=args.drain, seed=args.seed
+    )
+    try:
+        result = test.run()
+    finally:
+        test.close()
+
+    print(format_report(result))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nБаза сохранена: {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"\nБазы нет ({args.baseline}) - SLO не проверен. Сохранить: --save-baseline")
+        return 2
+
+    mismatch = params_mismatch(result, baseline)
+    if mismatch:
+        print(f"\nПрогон не сравним с базой: отличаются {', '.join(mismatch)}")
+        return 2
+
+    rows = compare(result, baseline, config.LOADTEST_SLO)
+    print()
+    print(format_comparison(rows, args.baseline))
+    return 0 if all(ok for *_, ok in rows) else 1
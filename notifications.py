@@ -0,0 +1,114 @@
+"""
+Модуль пакетной рассылки сообщений
+Фоновый поток отправляет уведомления пачками, не превышая лимиты Telegram
+"""
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+from loguru import logger
+
+from config import Config
+
+# Код ошибки отправки, когда чат недоступен навсегда: бот заблокирован, удален из группы
+# или чата нет (Telegram отвечает 403 или 400 "chat not found")
+CHAT_UNAVAILABLE = 403
+
+class BatchNotifier:
+    """
+    Очередь исходящих уведомлений с отправкой пачками
+    """
+
+    def __init__(self, bot: TeleBot):
+        self.config = Config()
+        self.bot = bot
+        self._queue: "queue.Queue[Tuple[int, str]]" = queue.Queue()
+        self._thread = None
+        # Пачки из всех источников (алерты, дайджесты) идут через одну паузу
+        self._pace_lock = threading.Lock()
+        self._next_batch_at = 0.0
+
+    def start(self):
+        """
+        Запускает фоновый поток отправки
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="batch-notifier", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, chat_id: int, text: str):
+        """
+        Ставит сообщение в очередь на отправку
+        """
+        self._queue.put((chat_id, text))
+
+    def enqueue_many(self, messages: List[Tuple[int, str]]):
+        """
+        Ставит в очередь сразу много сообщений.
+        Несколько сообщений одному чату склеиваются в одно
+        """
+        by_chat: Dict[int, List[str]] = {}
+        for chat_id, text in messages:
+            by_chat.setdefault(chat_id, []).append(text)
+
+        for chat_id, texts in by_chat.items():
+            self.enqueue(chat_id, "\n\n".join(texts))
+
+    def _take_batch(self) -> List[Tuple[int, str]]:
+        """Ждет первое сообщение и добирает пачку из того, что уже в очереди"""
+        batch = [self._queue.get()]
+        while len(batch) < self.config.NOTIFY_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Основной цикл потока отправки"""
+        while True:
+            self.deliver(self._take_batch())
+
+    def deliver(self, batch: List[Tuple[int, str]]) -> List[Optional[int]]:
+        """
+        Отправляет пачку в вызывающем потоке. Между пачками выдерживается пауза,
+        общая для всех отправителей, чтобы вместе не упереться в лимиты Telegram
+
+        Returns:
+            List[Optional[int]]: Для каждого сообщения пачки None если доставлено, иначе код ошибки
+        """
+        with self._pace_lock:
+            wait = self._next_batch_at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._next_batch_at = time.monotonic() + self.config.NOTIFY_BATCH_INTERVAL
+            return [self._send(chat_id, text) for chat_id, text in batch]
+
+    def _send(self, chat_id: int, text: str) -> Optional[int]:
+        """
+        Отправляет одно сообщение, при 429 ждет и повторяет один раз
+
+        Returns:
+            Optional[int]: None если доставлено, иначе код ошибки Telegram
+                (CHAT_UNAVAILABLE - чат недоступен, 0 - ошибка сети)
+        """
+        for attempt in range(2):
+            try:
+                self.bot.send_message(chat_id, text)
+                return None
+            except ApiTelegramException as e:
+                if e.error_code == 429 and attempt == 0:
+                    retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                    logger.warning(f"Лимит Telegram, ждем {retry_after} с")
+                    time.sleep(retry_after)
+                    continue
+                logger.error(f"Не удалось отправить уведомление в чат {chat_id}: {e}")
+                if e.error_code == 403 or 'chat not found' in str(e.description).lower():
+                    return CHAT_UNAVAILABLE
+                return e.error_code
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления в чат {chat_id}: {e}")
+                return 0
+        return 429
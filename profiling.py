@@ -0,0 +1,271 @@
+"""
+Модуль профилирования
+Сэмплирующий профайлер по запросу админа и трассировка обработки апдейтов по этапам.
+Выключенная трассировка почти ничего не стоит: span() отдает общий пустой объект
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from loguru import logger
+
+from config import Config
+
+# Листовые кадры, в которых поток ждет, а не считает: по ним отсеиваются простаивающие
+# потоки, если CPU-время потока недоступно (не Linux)
+_WAIT_FRAMES = {
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'readinto'),
+    ('ssl.py', 'read'),
+    ('connection.py', '_recv'),
+}
+
+def _thread_cpu_time(ident: int) -> Optional[float]:
+    """CPU-время потока в секундах или None, если платформа его не дает"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+class SamplingProfiler:
+    """
+    Раз в interval секунд снимает стеки потоков (sys._current_frames)
+    и пишет их в формате folded stacks - его понимают flamegraph.pl и speedscope.
+    По умолчанию профиль по CPU: в выборку попадают только потоки, которые с прошлой
+    выборки тратили процессор. В режиме wall - все потоки, включая ожидающие
+    """
+
+    def __init__(self, output_dir: str, interval: float):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = False
+        # code-объект -> "файл:функция", чтобы не собирать строку на каждый кадр
+        self._labels: Dict[object, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self, duration: float, on_done: Callable[[Optional[str], int], None], wall: bool = False) -> bool:
+        """
+        Запускает профилирование в фоне
+
+        Args:
+            duration: Сколько секунд снимать профиль
+            on_done: Вызывается по окончании с путем к файлу (None при ошибке) и числом выборок
+            wall: Профиль по реальному времени (с ожидающими потоками) вместо CPU
+
+        Returns:
+            bool: False если профилирование уже идет
+        """
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+
+        threading.Thread(target=self._run, args=(duration, on_done, wall), name="profiler", daemon=True).start()
+        return True
+
+    def _run(self, duration: float, on_done: Callable[[Optional[str], int], None], wall: bool):
+        path, samples = None, 0
+        try:
+            counts, samples = self._sample(duration, wall)
+            path = self._write(counts, 'wall' if wall else 'cpu')
+            logger.info(f"Профиль записан: {path} ({samples} выборок)")
+        except Exception as e:
+            logger.error(f"Ошибка профилирования: {e}")
+        finally:
+            self._running = False
+        on_done(path, samples)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def _on_cpu(self, ident: int, frame, cpu_times: Dict[int, float]) -> bool:
+        """
+        Тратил ли поток процессор с прошлой выборки. Без CPU-времени потока
+        (и в первой выборке) - не стоит ли он в известном ожидании
+        """
+        cpu_time = _thread_cpu_time(ident)
+        previous = cpu_times.get(ident)
+        if cpu_time is not None:
+            cpu_times[ident] = cpu_time
+            if previous is not None:
+                return cpu_time > previous
+        code = frame.f_code
+        return (os.path.basename(code.co_filename), code.co_name) not in _WAIT_FRAMES
+
+    def _sample(self, duration: float, wall: bool = False) -> Tuple[Dict[str, int], int]:
+        """Собирает выборки стеков: стек (от корня к листу через ;) -> число выборок"""
+        counts: Dict[str, int] = {}
+        cpu_times: Dict[int, float] = {}
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + duration
+        samples = 0
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if not wall and not self._on_cpu(ident, frame, cpu_times):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            samples += 1
+            time.sleep(self.interval)
+        return counts, samples
+
+    def _write(self, counts: Dict[str, int], mode: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{mode}.folded"
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
+
+class _NoopSpan:
+    """Пустой этап: трассировка выключена или апдейт не трассируется"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    """
+    Трасса обработки одного апдейта: этапы с вложенностью, смещением и длительностью
+    """
+    __slots__ = ('name', 'started', 'queued', 'duration', 'spans', 'depth')
+
+    def __init__(self, name: str, queued: float = 0.0):
+        self.name = name
+        self.started = time.perf_counter()
+        self.queued = queued  # сколько апдейт ждал в очереди до обработки
+        self.duration = 0.0
+        # (этап, вложенность, начало от старта трассы, длительность)
+        self.spans: List[Tuple[str, int, float, float]] = []
+        self.depth = 0
+
+    def format(self) -> str:
+        """Трасса текстом: этапы по порядку начала, вложенные - с отступом"""
+        lines = [f"{self.name} - {self.duration * 1000:.1f} мс (очередь {self.queued * 1000:.1f} мс)"]
+        for name, depth, offset, duration in sorted(self.spans, key=lambda span: (span[2], span[1])):
+            lines.append(f"{'  ' * (depth + 1)}{name} {duration * 1000:.1f} мс (+{offset * 1000:.1f})")
+        return '\n'.join(lines)
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started', 'depth')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.trace.depth
+        self.trace.depth += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        finished = time.perf_counter()
+        self.trace.depth -= 1
+        self.trace.spans.append((self.name, self.depth, self.started - self.trace.started, finished - self.started))
+        return False
+
+class Tracer:
+    """
+    Трассировка апдейтов по этапам (разбор -> курс -> форматирование -> отправка).
+    Текущая трасса хранится в потоке, поэтому этапы можно отмечать в любом модуле.
+    Медленные трассы попадают в кольцевой буфер
+    """
+
+    def __init__(self, buffer_size: int, slow_threshold: float, enabled: bool = False):
+        """
+        Args:
+            buffer_size: Сколько последних медленных трасс хранить
+            slow_threshold: С какой длительности (секунды) трасса считается медленной
+        """
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self._local = threading.local()
+        self._slow: Deque[Trace] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._traced = 0
+
+    def start(self, name: str, queued: float = 0.0) -> Optional[Trace]:
+        """
+        Начинает трассу апдейта в текущем потоке
+
+        Returns:
+            Trace: Трасса или None если трассировка выключена
+        """
+        if not self.enabled:
+            return None
+        trace = self._local.trace = Trace(name, queued)
+        return trace
+
+    def span(self, name: str):
+        """
+        Этап текущей трассы: with tracer.span('format'): ...
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return _NOOP_SPAN
+        return _Span(trace, name)
+
+    def finish(self, trace: Optional[Trace]):
+        """
+        Завершает трассу; медленная попадает в буфер
+        """
+        if trace is None:
+            return
+        self._local.trace = None
+        trace.duration = time.perf_counter() - trace.started
+        with self._lock:
+            self._traced += 1
+            if trace.duration + trace.queued >= self.slow_threshold:
+                self._slow.append(trace)
+
+    def slowest(self, limit: int) -> List[Trace]:
+        """Самые медленные трассы из буфера"""
+        with self._lock:
+            traces = list(self._slow)
+        traces.sort(key=lambda trace: trace.duration + trace.queued, reverse=True)
+        return traces[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._slow.clear()
+            self._traced = 0
+
+    @property
+    def traced(self) -> int:
+        """Сколько апдейтов оттрассировано с последней очистки"""
+        return self._traced
+
+# Общий трассировщик процесса: этапы отмечаются и в боте, и в CurrencyAPI
+tracer = Tracer(
+    buffer_size=Config.TRACE_BUFFER_SIZE,
+    slow_threshold=Config.TRACE_SLOW_MS / 1000,
+    enabled=Config.TRACING_ENABLED
+)
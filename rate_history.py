@@ -0,0 +1,281 @@
+"""
+Модуль истории курсов
+Append-only хранилище: по файлу на валюту, записи фиксированной длины,
+чтение через mmap без парсинга
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+from config import Config
+
+# Запись: время (uint32, unix) + цена 1 единицы валюты в USD (float64) - 12 байт
+RECORD = struct.Struct('<Id')
+
+class _Timestamps:
+    """Последовательность времен записей поверх mmap - для bisect"""
+
+    def __init__(self, view, count: int):
+        self._view = view
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> int:
+        return RECORD.unpack_from(self._view, index * RECORD.size)[0]
+
+class _Series:
+    """
+    Временной ряд одной валюты в отдельном файле
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap = None
+        self._mapped_size = 0
+        self._file_id = None
+        self.last_ts = 0
+        self.last_value: Optional[float] = None
+
+        records = self.records()
+        if records:
+            self.last_ts, self.last_value = records[-1]
+
+    def append(self, ts: int, value: float) -> bool:
+        """
+        Дописывает точку. Повтор прежнего значения не пишется -
+        ряд хранит только изменения (ступенчатая функция)
+        """
+        if ts <= self.last_ts or value == self.last_value:
+            return False
+        with open(self.path, 'ab') as f:
+            f.write(RECORD.pack(ts, value))
+        self.last_ts, self.last_value = ts, value
+        return True
+
+    def _view(self):
+        """Возвращает актуальный mmap файла (перемапливает, если файл вырос)"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None, 0
+
+        # Файл мог дорасти (дозапись) или быть подменен другим процессом (прореживание)
+        file_id = (stat.st_ino, stat.st_size)
+        if file_id != self._file_id or self._mmap is None:
+            self.close()
+            if stat.st_size == 0:
+                return None, 0
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = stat.st_size
+            self._file_id = file_id
+
+        return self._mmap, self._mapped_size // RECORD.size
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._mapped_size = 0
+        self._file_id = None
+
+    def records(self, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Точки ряда с временем в [start, end]
+        """
+        view, count = self._view()
+        if not count:
+            return []
+
+        timestamps = _Timestamps(view, count)
+        lo = bisect.bisect_left(timestamps, start) if start else 0
+        hi = bisect.bisect_right(timestamps, end) if end is not None else count
+        return [RECORD.unpack_from(view, i * RECORD.size) for i in range(lo, hi)]
+
+    def value_at(self, ts: int) -> Optional[float]:
+        """
+        Значение ряда на момент ts (последняя точка не позже ts)
+        """
+        view, count = self._view()
+        if not count:
+            return None
+
+        pos = bisect.bisect_right(_Timestamps(view, count), ts)
+        if pos == 0:
+            return None
+        return RECORD.unpack_from(view, (pos - 1) * RECORD.size)[1]
+
+    def rewrite(self, records: List[Tuple[int, float]]):
+        """Атомарно переписывает файл ряда (для прореживания и retention)"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(RECORD.pack(ts, value) for ts, value in records))
+        self.close()
+        os.replace(tmp_path, self.path)
+
+def downsample(points: List[Tuple[int, float]], step: int) -> List[Tuple[int, float]]:
+    """
+    Прореживает ряд: одна (последняя) точка на интервал step секунд
+    """
+    result: List[Tuple[int, float]] = []
+    for ts, value in points:
+        if result and result[-1][0] // step == ts // step:
+            result[-1] = (ts, value)
+        else:
+            result.append((ts, value))
+    return result
+
+class RateHistory:
+    """
+    История курсов всех валют в USD.
+    Курс пары считается как отношение двух рядов на один момент времени
+    """
+
+    def __init__(self, directory: str, raw_retention: int, retention: int, downsample_step: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.raw_retention = raw_retention
+        self.retention = retention
+        self.downsample_step = downsample_step
+
+        self._lock = threading.Lock()
+        self._series: Dict[str, _Series] = {}
+        self._last_compaction = 0.0
+
+        for name in os.listdir(directory):
+            if name.endswith('.bin'):
+                code = name[:-4]
+                self._series[code] = _Series(self._path(code))
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'RateHistory':
+        """История с каталогом и сроками хранения из Config (общая для бота и ingress-процесса)"""
+        return cls(
+            config.HISTORY_DIR,
+            raw_retention=config.HISTORY_RAW_RETENTION,
+            retention=config.HISTORY_RETENTION,
+            downsample_step=config.HISTORY_DOWNSAMPLE_STEP
+        )
+
+    def _path(self, code: str) -> str:
+        return os.path.join(self.directory, f"{code}.bin")
+
+    def _get_series(self, code: str) -> Optional[_Series]:
+        """Ряд валюты; файл мог появиться позже (его создал процесс-писатель)"""
+        series = self._series.get(code)
+        if series is None and os.path.exists(self._path(code)):
+            series = self._series[code] = _Series(self._path(code))
+        return series
+
+    def record(self, prices_usd: Dict[str, float], ts: Optional[float] = None):
+        """
+        Записывает снимок цен (валюта -> цена в USD) на момент ts
+        """
+        ts = int(ts if ts is not None else time.time())
+        with self._lock:
+            for code, price in prices_usd.items():
+                if code not in self._series:
+                    self._series[code] = _Series(self._path(code))
+                self._series[code].append(ts, price)
+
+        # Прореживание и retention - не чаще раза за интервал прореживания
+        if ts - self._last_compaction >= self.downsample_step:
+            self.compact(ts)
+
+    def compact(self, now: Optional[float] = None):
+        """
+        Прореживает точки старше raw_retention и удаляет точки старше retention
+        """
+        now = int(now if now is not None else time.time())
+        raw_from = now - self.raw_retention
+        keep_from = now - self.retention
+
+        with self._lock:
+            for series in self._series.values():
+                old = series.records(0, raw_from - 1)
+                if not old:
+                    continue
+                kept = downsample([p for p in old if p[0] >= keep_from], self.downsample_step)
+                expired = [p for p in old if p[0] < keep_from]
+                if expired and (not kept or kept[0][0] > keep_from):
+                    # Ряд хранит только изменения: последняя удаленная точка - все еще текущее
+                    # значение ступеньки, переносим ее на границу retention
+                    kept.insert(0, (keep_from, expired[-1][1]))
+                if kept == old:
+                    continue
+                series.rewrite(kept + series.records(raw_from))
+            self._last_compaction = now
+        logger.info("История курсов прорежена")
+
+    def value_at(self, from_currency: str, to_currency: str, ts: float) -> Optional[float]:
+        """
+        Курс пары на момент ts
+        """
+        with self._lock:
+            price_from = self._price_at(from_currency, int(ts))
+            price_to = self._price_at(to_currency, int(ts))
+        if price_from and price_to:
+            return price_from / price_to
+        return None
+
+    def _price_at(self, code: str, ts: int) -> Optional[float]:
+        if code == 'USD':
+            return 1.0
+        series = self._get_series(code)
+        return series.value_at(ts) if series else None
+
+    def _points(self, code: str, start: int, end: int) -> List[Tuple[int, float]]:
+        """Точки ряда в [start, end] плюс значение на момент start"""
+        if code == 'USD':
+            return [(start, 1.0)]
+        series = self._get_series(code)
+        if not series:
+            return []
+        points = series.records(start, end)
+        initial = series.value_at(start)
+        if initial is not None and (not points or points[0][0] > start):
+            points.insert(0, (start, initial))
+        return points
+
+    def range(self, from_currency: str, to_currency: str, start: float, end: Optional[float] = None,
+              step: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Курс пары на интервале [start, end]
+
+        Args:
+            step: Если задан - прореживание до одной точки на step секунд
+
+        Returns:
+            List[Tuple[int, float]]: (время, курс) по возрастанию времени
+        """
+        start = int(start)
+        end = int(end if end is not None else time.time())
+        with self._lock:
+            points_from = self._points(from_currency, start, end)
+            points_to = self._points(to_currency, start, end)
+
+        # Слияние двух ступенчатых рядов по времени
+        result: List[Tuple[int, float]] = []
+        i = j = 0
+        price_from = price_to = None
+        while i < len(points_from) or j < len(points_to):
+            ts_from = points_from[i][0] if i < len(points_from) else None
+            ts_to = points_to[j][0] if j < len(points_to) else None
+            ts = min(t for t in (ts_from, ts_to) if t is not None)
+            if ts_from == ts:
+                price_from = points_from[i][1]
+                i += 1
+            if ts_to == ts:
+                price_to = points_to[j][1]
+                j += 1
+            if price_from and price_to:
+                result.append((ts, price_from / price_to))
+
+        return downsample(result, step) if step else result
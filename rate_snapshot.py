@@ -0,0 +1,210 @@
+"""
+Модуль снимка курсов
+Все курсы лежат одним массивом float64 в порядке каталога валют: фиатная строка
+(единиц валюты за 1 USD) и крипто-сетка (цена монеты в каждой валюте котировки).
+Файл снимка - заголовок, таблица кодов и тот же массив байт в байт, поэтому
+загрузка через mmap ничего не разбирает, а поиск курса - это индексация массива
+"""
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from loguru import logger
+
+MAGIC = b'RSNP'
+FORMAT_VERSION = 2
+
+# Заголовок: магия, версия формата, время снимка, время курсов фиата и крипты у провайдеров,
+# число фиатов, монет, валют котировки, резерв, источники фиата и крипты.
+# Размер кратен 8 - массив курсов в файле выровнен под float64
+HEADER = struct.Struct('<4sIdddIIII32s32s')
+CODE = struct.Struct('<8s')
+
+def _ordered(codes: Iterable[str], order: Sequence[str]) -> List[str]:
+    """Коды в порядке каталога; чего нет в каталоге - в конце по алфавиту"""
+    codes = set(codes)
+    result = [code for code in order if code in codes]
+    seen = set(result)
+    result.extend(sorted(code for code in codes if code not in seen))
+    return result
+
+class RateTable:
+    """
+    Все курсы одного снимка. Массив значений - array('d') у процесса, который получил курсы
+    из API, или memoryview прямо на mmap файла у читателей
+    """
+    __slots__ = ('updated_at', 'fiat_as_of', 'crypto_as_of', 'sources',
+                 'fiat_index', 'crypto_index', 'vs_index', 'values', '_crypto_offset', '_n_vs', '_buffer')
+
+    def __init__(self, fiat_codes: List[str], crypto_codes: List[str], vs_codes: List[str], values,
+                 updated_at: float, fiat_as_of: float = 0.0, crypto_as_of: float = 0.0,
+                 sources: Tuple[str, str] = ('', ''), buffer=None):
+        """
+        Args:
+            values: float64 подряд: фиат, затем крипто-сетка построчно (NaN - цены нет)
+            updated_at: Время снимка (unix)
+            fiat_as_of / crypto_as_of: Время курсов у провайдера
+            sources: Откуда курсы фиата и крипты
+            buffer: mmap, на который смотрит values (держим, пока жива таблица)
+        """
+        self.updated_at = updated_at
+        self.fiat_as_of = fiat_as_of
+        self.crypto_as_of = crypto_as_of
+        self.sources = sources
+        self.fiat_index: Dict[str, int] = {code: i for i, code in enumerate(fiat_codes)}
+        self.crypto_index: Dict[str, int] = {code: i for i, code in enumerate(crypto_codes)}
+        self.vs_index: Dict[str, int] = {code: i for i, code in enumerate(vs_codes)}
+        self.values = values
+        self._crypto_offset = len(fiat_codes)
+        self._n_vs = len(vs_codes)
+        self._buffer = buffer
+
+    @classmethod
+    def empty(cls) -> 'RateTable':
+        return cls([], [], [], array('d'), 0.0)
+
+    @classmethod
+    def build(cls, fiat_rates: Dict[str, float], crypto_rates: Dict[str, Dict[str, float]],
+              updated_at: float, fiat_order: Sequence[str] = (), crypto_order: Sequence[str] = (),
+              vs_order: Sequence[str] = (), fiat_as_of: float = 0.0, crypto_as_of: float = 0.0,
+              sources: Tuple[str, str] = ('', '')) -> 'RateTable':
+        """
+        Собирает таблицу из ответов API
+
+        Args:
+            fiat_rates: Единиц валюты за 1 USD
+            crypto_rates: Цена монеты в валютах котировки
+            fiat_order / crypto_order / vs_order: Порядок кодов (позиции в каталоге)
+        """
+        fiat_codes = _ordered(fiat_rates, fiat_order)
+        crypto_codes = _ordered(crypto_rates, crypto_order)
+        vs_codes = _ordered((vs for prices in crypto_rates.values() for vs in prices), vs_order)
+
+        values = array('d', (fiat_rates[code] for code in fiat_codes))
+        for crypto in crypto_codes:
+            prices = crypto_rates[crypto]
+            values.extend(prices.get(vs, math.nan) for vs in vs_codes)
+        return cls(fiat_codes, crypto_codes, vs_codes, values, updated_at, fiat_as_of, crypto_as_of, sources)
+
+    def fiat_rate(self, code: str) -> Optional[float]:
+        """Единиц валюты за 1 USD"""
+        i = self.fiat_index.get(code)
+        return self.values[i] if i is not None else None
+
+    def crypto_price(self, code: str, vs: str) -> Optional[float]:
+        """Цена монеты в валюте котировки или None"""
+        row = self.crypto_index.get(code)
+        col = self.vs_index.get(vs)
+        if row is None or col is None:
+            return None
+        price = self.values[self._crypto_offset + row * self._n_vs + col]
+        return None if math.isnan(price) else price
+
+    def to_bytes(self) -> bytes:
+        """Снимок в формате файла"""
+        def encode(text: str) -> bytes:
+            return text.encode('utf-8')[:32]
+
+        header = HEADER.pack(
+            MAGIC, FORMAT_VERSION, self.updated_at, self.fiat_as_of, self.crypto_as_of,
+            len(self.fiat_index), len(self.crypto_index), len(self.vs_index), 0,
+            encode(self.sources[0]), encode(self.sources[1])
+        )
+        codes = b''.join(
+            CODE.pack(code.encode('ascii'))
+            for code in list(self.fiat_index) + list(self.crypto_index) + list(self.vs_index)
+        )
+        values = array('d', self.values)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return header + codes + values.tobytes()
+
+def write_snapshot(path: str, table: RateTable):
+    """
+    Записывает снимок атомарно: во временный файл и os.replace.
+    Читатели со старым mmap дочитывают прежний файл
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(table.to_bytes())
+    os.replace(tmp_path, path)
+
+def load_snapshot(path: str) -> Optional[RateTable]:
+    """
+    Открывает снимок через mmap без разбора значений
+
+    Returns:
+        RateTable: Таблица поверх файла или None если файла нет или формат другой
+    """
+    with open(path, 'rb') as f:
+        view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(view) < HEADER.size:
+        return None
+    (magic, version, updated_at, fiat_as_of, crypto_as_of,
+     n_fiat, n_crypto, n_vs, _, fiat_source, crypto_source) = HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+
+    n_codes = n_fiat + n_crypto + n_vs
+    n_values = n_fiat + n_crypto * n_vs
+    offset = HEADER.size + n_codes * CODE.size
+    if len(view) < offset + n_values * 8:
+        return None
+
+    codes = [
+        CODE.unpack_from(view, HEADER.size + i * CODE.size)[0].rstrip(b'\0').decode('ascii') for i in range(n_codes)
+    ]
+
+    if sys.byteorder == 'little':
+        # Массив курсов - прямо страницы файла, без копирования
+        values = memoryview(view)[offset:offset + n_values * 8].cast('d')
+        buffer = view
+    else:
+        values = array('d', view[offset:offset + n_values * 8])
+        values.byteswap()
+        buffer = None
+
+    sources = tuple(source.rstrip(b'\0').decode('utf-8', 'ignore') for source in (fiat_source, crypto_source))
+    return RateTable(
+        codes[:n_fiat], codes[n_fiat:n_fiat + n_crypto], codes[n_fiat + n_crypto:], values,
+        updated_at, fiat_as_of, crypto_as_of, sources, buffer
+    )
+
+class SnapshotReader:
+    """
+    Открывает снимок заново, когда писатель подменил файл
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file_id: Optional[Tuple[int, int]] = None
+
+    def load_if_changed(self) -> Optional[RateTable]:
+        """
+        Returns:
+            RateTable: Новый снимок или None если файл не менялся (или его нет)
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+
+        # os.replace дает новый inode - по нему и времени изменения видим новый снимок
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if file_id == self._file_id or stat.st_size < HEADER.size:
+            return None
+
+        try:
+            table = load_snapshot(self.path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка чтения снимка курсов {self.path}: {e}")
+            return None
+        self._file_id = file_id
+        return table
@@ -0,0 +1,77 @@
+"""
+Модуль кэша готовых ответов бота
+Одинаковые запросы ("100 USDT в UAH") в пределах одного снимка курсов
+получают уже собранный текст без конвертации и форматирования
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class ReplyCache:
+    """
+    LRU-кэш ответов, привязанный к версии данных (снимка курсов, каталога валют).
+    Пришла новая версия - все старые ответы выбрасываются разом, TTL не нужен
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+
+        # Метрики
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _check_version(self, version: int) -> bool:
+        """
+        Сбрасывает кэш, если пришел более новый снимок (вызывается под блокировкой)
+
+        Returns:
+            bool: True если version - текущая версия кэша
+        """
+        if version > self._version:
+            if self._items:
+                self._items.clear()
+                self._invalidations += 1
+            self._version = version
+        return version == self._version
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        """
+        Готовый ответ (текст, клавиатура) при данной версии или None
+        """
+        with self._lock:
+            reply = self._items.get(key) if self._check_version(version) else None
+            if reply is None:
+                self._misses += 1
+                return None
+            self._items.move_to_end(key)
+            self._hits += 1
+            return reply
+
+    def put(self, key: Hashable, version: int, reply: Any):
+        """
+        Запоминает ответ. Ответ по устаревшей версии не сохраняется
+        """
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._items[key] = reply
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Метрики: попадания, промахи, сбросы по новой версии, размер
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'invalidations': self._invalidations,
+                'size': len(self._items),
+                'version': self._version
+            }
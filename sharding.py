@@ -0,0 +1,200 @@
+"""
+Модуль горизонтального масштабирования
+Один ingress-процесс получает апдейты и раздает их N воркерам по chat_id
+"""
+import asyncio
+import multiprocessing
+import queue
+import threading
+import time
+from typing import List, Optional
+from telebot import apihelper
+from loguru import logger
+
+from config import Config
+from currency_api import CurrencyAPI
+from rate_history import RateHistory
+
+def shard_key(update: dict) -> int:
+    """
+    Ключ шардирования апдейта - id чата.
+    Все апдейты одного чата попадают в один воркер, где выполняются в очереди
+    admission этого чата: сохраняется порядок сообщений и состояние пользователя
+    (в личке chat_id == user_id)
+    """
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if field in update:
+            return update[field]['chat']['id']
+
+    if 'callback_query' in update:
+        callback = update['callback_query']
+        if 'message' in callback:
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+
+    for field in ('inline_query', 'chosen_inline_result', 'my_chat_member', 'chat_member', 'chat_join_request'):
+        if field in update:
+            obj = update[field]
+            return (obj.get('chat') or obj['from'])['id']
+
+    return update['update_id']
+
+def _worker_main(index: int, count: int, updates: multiprocessing.Queue):
+    """Точка входа процесса-воркера"""
+    # Импорт здесь, чтобы не тянуть бота в ingress-процесс
+    from bot import CurrencyBot
+
+    bot = CurrencyBot(shard=(index, count))
+    bot.run_worker(updates)
+
+class ShardedRunner:
+    """
+    Ingress-процесс: long polling Telegram, обновление курсов и раздача апдейтов воркерам
+    """
+
+    def __init__(self, workers: int):
+        self.config = Config()
+        self.workers = workers
+        # spawn - воркеры не наследуют потоки и соединения ingress-процесса
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        # С какого момента очередь шарда полна (None - разбирается) и сколько апдейтов отброшено
+        self._stalled_since: List[Optional[float]] = [None] * workers
+        self._dropped = [0] * workers
+        self._lock = threading.Lock()
+        logger.add("bot.log", rotation="1 MB", level="INFO")
+
+        # Курсы из API получает только ingress и публикует их общим снимком
+        self.currency_api = CurrencyAPI(self.config.RATES_SNAPSHOT_PATH)
+        self.rate_history = RateHistory.from_config(self.config)
+        self.currency_api.add_rate_listener(self._publish_rates)
+
+    def _publish_rates(self, api: CurrencyAPI):
+        """Пишет историю курсов (общий снимок для воркеров CurrencyAPI уже сохранил)"""
+        self.rate_history.record(api.get_snapshot_prices_usd(), api.rates_updated_at)
+
+    def _start_workers(self):
+        for index in range(self.workers):
+            updates = self._context.Queue(maxsize=self.config.SHARD_QUEUE_SIZE)
+            process = self._context.Process(
+                target=_worker_main, args=(index, self.workers, updates),
+                name=f"bot-worker-{index}", daemon=True
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+        logger.info(f"Запущено воркеров: {self.workers}")
+
+    def _restart_worker(self, index: int):
+        process = self._context.Process(
+            target=_worker_main, args=(index, self.workers, self._queues[index]),
+            name=f"bot-worker-{index}", daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _check_workers(self):
+        """
+        Перезапускает упавших воркеров (очередь шарда сохраняется) и зависших -
+        живых, но не разбирающих полную очередь дольше WORKER_STALL_TIMEOUT
+        """
+        now = time.monotonic()
+        with self._lock:
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.error(f"Воркер {index} завершился (код {process.exitcode}), перезапускаем")
+                    self._restart_worker(index)
+                    continue
+
+                stalled_since = self._stalled_since[index]
+                if stalled_since is None or now - stalled_since < self.config.WORKER_STALL_TIMEOUT:
+                    continue
+                logger.error(
+                    f"Воркер {index} не разбирает очередь {now - stalled_since:.0f} с "
+                    f"(отброшено апдейтов: {self._dropped[index]}), перезапускаем"
+                )
+                process.terminate()
+                process.join(5)
+                # Очередь убитого процесса может остаться с захваченной блокировкой - заводим новую
+                old_queue = self._queues[index]
+                old_queue.cancel_join_thread()
+                old_queue.close()
+                self._queues[index] = self._context.Queue(maxsize=self.config.SHARD_QUEUE_SIZE)
+                self._stalled_since[index] = None
+                self._dropped[index] = 0
+                self._restart_worker(index)
+
+    def _health_loop(self):
+        """Проверяет воркеров независимо от цикла получения апдейтов"""
+        while True:
+            time.sleep(self.config.WORKER_CHECK_INTERVAL)
+            try:
+                self._check_workers()
+            except Exception as e:
+                logger.error(f"Ошибка проверки воркеров: {e}")
+
+    def _dispatch(self, update: dict):
+        """
+        Кладет апдейт в очередь шарда, не блокируя ingress: ждем места не дольше
+        SHARD_PUT_TIMEOUT, а пока шард завис - отбрасываем сразу, чтобы не тормозить
+        остальные шарды. Зависший воркер перезапускает _health_loop
+        """
+        index = shard_key(update) % self.workers
+        with self._lock:
+            updates = self._queues[index]
+        try:
+            if self._stalled_since[index] is None:
+                updates.put(update, timeout=self.config.SHARD_PUT_TIMEOUT)
+            else:
+                updates.put_nowait(update)
+        except ValueError:
+            # Пока ждали места, _health_loop закрыл очередь зависшего воркера
+            logger.warning(f"Очередь воркера {index} заменена, апдейт {update.get('update_id')} отброшен")
+            return
+        except queue.Full:
+            self._dropped[index] += 1
+            if self._stalled_since[index] is None:
+                self._stalled_since[index] = time.monotonic()
+                logger.warning(f"Очередь воркера {index} полна, апдейты шарда отбрасываются")
+            return
+
+        if self._stalled_since[index] is not None:
+            logger.info(f"Воркер {index} снова разбирает очередь (отброшено апдейтов: {self._dropped[index]})")
+            self._stalled_since[index] = None
+            self._dropped[index] = 0
+
+    def run(self):
+        """
+        Запускает воркеров и цикл получения апдейтов
+        """
+        if not self.config.BOT_TOKEN:
+            logger.error("BOT_TOKEN не задан! Создайте файл .env с токеном.")
+            return
+
+        # Первый снимок до старта воркеров, чтобы им было что читать
+        asyncio.run(self.currency_api.refresh_rates(force=True))
+        self._start_workers()
+        threading.Thread(
+            target=self.currency_api.refresh_loop, args=(self.config.RATE_REFRESH_INTERVAL,),
+            name="rate-refresh", daemon=True
+        ).start()
+        threading.Thread(target=self._health_loop, name="worker-health", daemon=True).start()
+
+        logger.info("Ingress запущен и готов к работе!")
+        offset = None
+        while True:
+            try:
+                updates = apihelper.get_updates(self.config.BOT_TOKEN, offset=offset, limit=100,
+                                                long_polling_timeout=5)
+            except Exception as e:
+                logger.error(f"Ошибка получения апдейтов: {e}")
+                time.sleep(3)
+                continue
+
+            for update in updates:
+                offset = update['update_id'] + 1
+                try:
+                    self._dispatch(update)
+                except Exception as e:
+                    logger.error(f"Ошибка передачи апдейта {update.get('update_id')} воркеру: {e}")
@@ -0,0 +1,284 @@
+"""
+Модуль подписок на рассылку курсов (дайджесты)
+Подписки хранятся в SQLite с индексом по времени отправки.
+Дайджест рендерится один раз на (набор пар, язык, слот) и через исходящую очередь
+в той же базе уходит всем подписчикам - после падения рассылка продолжается с места остановки
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from loguru import logger
+
+# Расписания (слова команды /subscribe - Config.DIGEST_SCHEDULES)
+HOURLY = 'hourly'
+DAILY = 'daily'
+
+Pair = Tuple[str, str]
+
+def pairs_key(pairs: List[Pair]) -> str:
+    """Набор пар одной строкой без повторов и с фиксированным порядком: 'BTC/USD,USDT/UAH'"""
+    return ','.join(sorted({f"{from_currency}/{to_currency}" for from_currency, to_currency in pairs}))
+
+def parse_pairs_key(key: str) -> List[Pair]:
+    return [tuple(pair.split('/')) for pair in key.split(',')]
+
+def next_slot(schedule: str, hour: int, now: float) -> int:
+    """
+    Ближайшее время отправки после now (unix, UTC):
+    начало следующего часа или ближайшие hour:00 для ежедневной рассылки
+    """
+    if schedule == HOURLY:
+        return (int(now) // 3600 + 1) * 3600
+    day_start = int(now) // 86400 * 86400
+    slot = day_start + hour * 3600
+    return slot if slot > now else slot + 86400
+
+class SubscriptionStore:
+    """
+    Подписки, готовые дайджесты и исходящая очередь рассылки
+    """
+
+    def __init__(self, db_path: str, shard: Optional[Tuple[int, int]] = None):
+        """
+        Args:
+            db_path: Путь к файлу SQLite
+            shard: (номер, всего) - воркер рассылает только подписчикам своих чатов
+        """
+        self.shard = shard
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                pairs TEXT NOT NULL,
+                schedule TEXT NOT NULL,
+                hour INTEGER NOT NULL,
+                locale TEXT NOT NULL,
+                next_send_at INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS subscriptions_next_send ON subscriptions (next_send_at);
+            CREATE INDEX IF NOT EXISTS subscriptions_user ON subscriptions (user_id);
+
+            -- Готовый текст дайджеста: один на набор пар, язык и слот
+            CREATE TABLE IF NOT EXISTS digests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pairs TEXT NOT NULL,
+                locale TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                UNIQUE (pairs, locale, slot)
+            );
+
+            -- Исходящая очередь: отправленные строки удаляются пачками (это и есть чекпоинт)
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                digest_id INTEGER NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def _shard_filter(self, column: str) -> Tuple[str, tuple]:
+        """Условие WHERE на чаты своего шарда (остаток как в Python: у групп chat_id отрицательный)"""
+        if not self.shard:
+            return "1", ()
+        index, count = self.shard
+        return f"(({column} % ?) + ?) % ? = ?", (count, count, count, index)
+
+    def add(self, user_id: int, chat_id: int, pairs: List[Pair], schedule: str, hour: int, locale: str) -> int:
+        """
+        Добавляет подписку
+
+        Returns:
+            int: Номер новой подписки
+        """
+        next_send_at = next_slot(schedule, hour, time.time())
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO subscriptions (user_id, chat_id, pairs, schedule, hour, locale, next_send_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, pairs_key(pairs), schedule, hour, locale, next_send_at, time.time())
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def remove(self, user_id: int, subscription_id: Optional[int] = None) -> int:
+        """
+        Удаляет подписку пользователя (или все, если номер не указан)
+
+        Returns:
+            int: Сколько подписок удалено
+        """
+        with self._lock:
+            if subscription_id is None:
+                cursor = self._db.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
+            else:
+                cursor = self._db.execute(
+                    "DELETE FROM subscriptions WHERE id = ? AND user_id = ?", (subscription_id, user_id)
+                )
+            self._db.commit()
+            return cursor.rowcount
+
+    def remove_chat(self, chat_id: int) -> int:
+        """
+        Удаляет все подписки чата и его неотправленные дайджесты
+        (чат недоступен: бот заблокирован или удален из группы)
+
+        Returns:
+            int: Сколько подписок удалено
+        """
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+            self._db.execute("DELETE FROM outbox WHERE chat_id = ?", (chat_id,))
+            self._db.commit()
+            return cursor.rowcount
+
+    def list_for_user(self, user_id: int) -> List[dict]:
+        """
+        Возвращает подписки пользователя
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, pairs, schedule, hour, next_send_at FROM subscriptions WHERE user_id = ? ORDER BY id",
+                (user_id,)
+            ).fetchall()
+        return [
+            {'id': r[0], 'pairs': parse_pairs_key(r[1]), 'schedule': r[2], 'hour': r[3], 'next_send_at': r[4]}
+            for r in rows
+        ]
+
+    def count_for_user(self, user_id: int) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM subscriptions WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def plan_due(self, now: float, render: Callable[[List[Pair], str, int], Optional[str]],
+                 limit: int = 5000) -> int:
+        """
+        Ставит в исходящую очередь дайджесты подписок, у которых подошло время.
+        Дайджест рендерится один раз на (набор пар, язык, слот) - без блокировки и
+        транзакции; постановка в очередь и перенос времени следующей отправки -
+        одна короткая транзакция
+
+        Args:
+            render: Функция (пары, язык, слот) -> текст или None (курсов нет - попробуем позже)
+            limit: Сколько подписок обработать за раз
+
+        Returns:
+            int: Сколько сообщений поставлено в очередь
+        """
+        shard_where, shard_params = self._shard_filter('chat_id')
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, chat_id, pairs, schedule, hour, locale, next_send_at FROM subscriptions "
+                f"WHERE next_send_at <= ? AND {shard_where} ORDER BY next_send_at LIMIT ?",
+                (int(now),) + shard_params + (limit,)
+            ).fetchall()
+            if not rows:
+                return 0
+            keys = {(pairs, locale, slot) for _, _, pairs, _, _, locale, slot in rows}
+            digest_ids = self._digest_ids(keys)
+
+        texts: Dict[Tuple[str, str, int], str] = {}
+        for key in keys - digest_ids.keys():
+            pairs, locale, slot = key
+            try:
+                text = render(parse_pairs_key(pairs), locale, slot)
+            except Exception as e:
+                logger.error(f"Ошибка рендеринга дайджеста {pairs}: {e}")
+                continue
+            if text is not None:
+                texts[key] = text
+
+        queued = 0
+        with self._lock:
+            if texts:
+                # Тот же дайджест мог только что сохранить воркер другого шарда - берем его
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO digests (pairs, locale, slot, text) VALUES (?, ?, ?, ?)",
+                    [key + (text,) for key, text in texts.items()]
+                )
+                digest_ids.update(self._digest_ids(texts.keys()))
+
+            for sub_id, chat_id, pairs, schedule, hour, locale, slot in rows:
+                digest_id = digest_ids.get((pairs, locale, slot))
+                if digest_id is None:
+                    continue
+                # Пропущенные слоты (бот был выключен) не догоняем - следующий после now.
+                # Условие на slot: подписку не изменили и не поставили в очередь, пока рендерили
+                cursor = self._db.execute(
+                    "UPDATE subscriptions SET next_send_at = ? WHERE id = ? AND next_send_at = ?",
+                    (next_slot(schedule, hour, now), sub_id, slot)
+                )
+                if cursor.rowcount:
+                    self._db.execute("INSERT INTO outbox (chat_id, digest_id) VALUES (?, ?)", (chat_id, digest_id))
+                    queued += 1
+            self._db.commit()
+
+        logger.info(f"Дайджестов в очереди: {queued} (отрендерено текстов: {len(texts)})")
+        return queued
+
+    def _digest_ids(self, keys) -> Dict[Tuple[str, str, int], int]:
+        """Номера уже готовых дайджестов по ключам (pairs, locale, slot) (вызывается под блокировкой)"""
+        result = {}
+        for key in keys:
+            row = self._db.execute(
+                "SELECT id FROM digests WHERE pairs = ? AND locale = ? AND slot = ?", key
+            ).fetchone()
+            if row:
+                result[key] = row[0]
+        return result
+
+    def pending(self, limit: int) -> List[Tuple[int, int, str]]:
+        """
+        Следующие сообщения исходящей очереди своего шарда
+
+        Returns:
+            List[Tuple[int, int, str]]: (номер в очереди, chat_id, текст) по порядку
+        """
+        shard_where, shard_params = self._shard_filter('outbox.chat_id')
+        with self._lock:
+            return self._db.execute(
+                f"SELECT outbox.id, outbox.chat_id, digests.text FROM outbox "
+                f"JOIN digests ON digests.id = outbox.digest_id "
+                f"WHERE {shard_where} ORDER BY outbox.id LIMIT ?",
+                shard_params + (limit,)
+            ).fetchall()
+
+    def ack(self, outbox_ids: List[int]):
+        """
+        Чекпоинт: отправленные сообщения удаляются из очереди.
+        После падения повторно уйдет не больше одной пачки
+        """
+        if not outbox_ids:
+            return
+        with self._lock:
+            placeholders = ','.join('?' * len(outbox_ids))
+            self._db.execute(f"DELETE FROM outbox WHERE id IN ({placeholders})", outbox_ids)
+            self._db.commit()
+
+    def cleanup(self, older_than: float):
+        """Удаляет старые дайджесты, которых уже нет в исходящей очереди"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM digests WHERE slot < ? AND id NOT IN (SELECT DISTINCT digest_id FROM outbox)",
+                (int(older_than),)
+            )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'subscriptions': self._db.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0],
+                'outbox': self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0],
+                'digests': self._db.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+            }